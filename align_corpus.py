@@ -0,0 +1,115 @@
+"""
+Align a parallel corpus from the command line and write the alignments in Pharaoh format.
+
+Examples:
+    python align_corpus.py --src corpus.bn --tgt corpus.en --output corpus.align
+    python align_corpus.py --tsv corpus.tsv --output corpus.align --resume
+    python align_corpus.py --tsv corpus.tsv --output corpus.align --workers 8 --threads-per-worker 4
+    python align_corpus.py --tsv corpus.tsv --output corpus.store --format store --resume
+"""
+
+import os
+import argparse
+import itertools
+
+from helper.alignment_mappers import align_batch
+from helper.alignment_results import AlignmentResult, render_pharaoh
+from helper.sharded_aligners import align_sharded
+from helper.corpus_readers import read_parallel_files, read_tsv_file, get_batches, count_complete_lines
+from helper.alignment_stores import AlignmentStoreWriter
+
+
+def get_args():
+    parser = argparse.ArgumentParser(
+        description="Align a parallel corpus and write Pharaoh (i-j) alignments")
+    parser.add_argument("--src", help="Source sentences, one per line")
+    parser.add_argument("--tgt", help="Target sentences, one per line")
+    parser.add_argument("--tsv", help="Tab separated source and target sentences")
+    parser.add_argument("--output", required=True,
+                        help="Output file of Pharaoh alignments (directory of the store with --format store)")
+    parser.add_argument("--format", choices=["pharaoh", "store"], default="pharaoh",
+                        help="Pharaoh text lines or the binary alignment store (helper/alignment_stores.py)")
+    parser.add_argument("--model", default="Google-mBERT (Base-Multilingual)",
+                        help="Model display name or checkpoint")
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Number of worker processes")
+    parser.add_argument("--threads-per-worker", type=int, default=1,
+                        help="Torch threads of each worker process")
+    parser.add_argument("--shard-size", type=int, default=256,
+                        help="Sentence pairs sent to a worker at a time")
+    parser.add_argument("--start-line", type=int, default=0,
+                        help="Skip the first lines of the corpus")
+    parser.add_argument("--resume", action="store_true",
+                        help="Append to the output, skipping the lines it already holds")
+    args = parser.parse_args()
+
+    if bool(args.tsv) == bool(args.src or args.tgt) or (args.src is None) != (args.tgt is None):
+        parser.error("give either --src and --tgt, or --tsv")
+
+    return args
+
+
+def align_corpus(pairs, output_file, model_name, batch_size=32, workers=1, threads_per_worker=1, shard_size=256):
+    """
+    Align a stream of sentence pairs batch by batch (or shard by shard with several workers)
+    and write one Pharaoh line per pair (or append them to an `AlignmentStoreWriter`)
+    """
+    if workers > 1:
+        results = align_sharded(
+            pairs, model_name=model_name, num_workers=workers,
+            threads_per_worker=threads_per_worker, shard_size=shard_size, batch_size=batch_size)
+    else:
+        results = itertools.chain.from_iterable(
+            align_batch(batch, model_name=model_name, batch_size=batch_size)
+            for batch in get_batches(pairs, batch_size))
+
+    count = 0
+
+    for batch in get_batches(results, batch_size):
+        if isinstance(output_file, AlignmentStoreWriter):
+            output_file.append_batch(batch)
+        else:
+            output_file.write("".join(
+                render_pharaoh(AlignmentResult.from_align_words(*result)) + "\n" for result in batch))
+        output_file.flush()
+
+        count += len(batch)
+
+    return count
+
+
+def main():
+    args = get_args()
+
+    if args.tsv:
+        pairs = read_tsv_file(args.tsv)
+    else:
+        pairs = read_parallel_files(args.src, args.tgt)
+
+    start_line = args.start_line
+
+    if args.format == "store":
+        if os.path.exists(args.output) and not args.resume:
+            raise SystemExit(f"{args.output} exists, use --resume to append to the store")
+        output_file = AlignmentStoreWriter(args.output)
+        start_line += output_file.num_sentences
+    else:
+        mode = "w"
+        if args.resume and os.path.exists(args.output):
+            start_line += count_complete_lines(args.output)
+            mode = "a"
+        output_file = open(args.output, mode, encoding="utf-8")
+
+    pairs = itertools.islice(pairs, start_line, None)
+
+    with output_file:
+        count = align_corpus(
+            pairs, output_file, args.model, batch_size=args.batch_size, workers=args.workers,
+            threads_per_worker=args.threads_per_worker, shard_size=args.shard_size)
+
+    print(f"Aligned {count} sentence pairs from line {start_line}")
+
+
+if __name__ == "__main__":
+    main()
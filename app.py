@@ -1,9 +1,16 @@
+import os
+import json
+
 import gradio as gr
 from gradio_rich_textbox import RichTextbox
 
 from helper.text_preprocess import space_punc
-from helper.alignment_mappers import select_model, get_alignments_table
-from helper.translators import select_target_lang_code, google_translation, get_better_translation
+from helper.alignment_mappers import select_model, select_align_layer, select_encoder_backend, get_alignments_table
+from helper.model_loaders import warm_up_models
+from helper.batch_schedulers import get_batched_alignment_mapping
+from helper.resources import get_startup_profile, get_missing_resources, provision_resources, is_offline
+from helper.metrics import span, profiled, start_metrics_logger
+from helper.translators import select_target_lang_code, get_translations
 
 
 def process_alignments(src, language_name, model_name):
@@ -14,24 +21,29 @@ def process_alignments(src, language_name, model_name):
     tgt = None
     tgt_base = None
     html_table = None
-    
-    src = space_punc(src)
 
-    tgt_lang_code = select_target_lang_code(language_name)
+    # a sampled fraction of the requests is profiled (PROFILE_SAMPLE_RATE),
+    # the alignment batches are profiled on the scheduler thread that runs them
+    with profiled("process_alignments"), span("process_alignments"):
+        with span("preprocess"):
+            src = space_punc(src)
 
-    tgt = get_better_translation(src, tgt_lang_code)
+        tgt_lang_code = select_target_lang_code(language_name)
 
-    tgt = space_punc(tgt)
+        tgt_base, tgt = get_translations(src, tgt_lang_code)
 
-    tgt_base = google_translation(src, tgt_lang_code)
+        with span("preprocess"):
+            tgt = space_punc(tgt)
 
-    model_name = select_model(model_name)
+        model_name = select_model(model_name)
 
-    html_table, alignment_accuracy = get_alignments_table(
-        source=src,
-        target=tgt,
-        model_name=model_name 
-    )
+        # concurrent requests are aligned together by the micro-batching scheduler
+        html_table, alignment_accuracy = get_alignments_table(
+            source=src,
+            target=tgt,
+            model_name=model_name,
+            get_mapping=get_batched_alignment_mapping
+        )
 
     return tgt_base, html_table, alignment_accuracy
     
@@ -175,7 +187,8 @@ with gr.Blocks(css="styles.css") as demo:
                 gr.Textbox(label="Alignment Accuracy")
             ]
 
-    btn.click(process_alignments, inputs, outputs)
+    # let concurrent requests reach the micro-batching scheduler together
+    btn.click(process_alignments, inputs, outputs, concurrency_limit=16)
 
     gr.Examples([
         [
@@ -205,4 +218,20 @@ with gr.Blocks(css="styles.css") as demo:
 
 # Launch the Gradio app
 if __name__ == "__main__":
+    ui_models = ["Google-mBERT (Base-Multilingual)", "SentenceTransformers-LaBSE (Multilingual)"]
+    # a host that was never provisioned (e.g. a new Space) downloads the missing models once
+    model_names = [select_model(model_name) for model_name in ui_models]
+    if get_missing_resources(model_names, pos_taggers=False) and not is_offline():
+        provision_resources(model_names, pos_taggers=False, offline=False)
+    # Load the models offered in the UI once, before serving the first request
+    for model_name in ui_models:
+        warm_up_models(
+            [select_model(model_name)], num_layers=select_align_layer(model_name),
+            backend=select_encoder_backend(model_name))
+    # per-import timings of the lazily imported libraries
+    if os.environ.get("STARTUP_PROFILE"):
+        print(json.dumps(get_startup_profile(), indent=2))
+    # per-stage latency histograms and counters, logged every METRICS_LOG_INTERVAL seconds
+    if os.environ.get("METRICS_LOG_INTERVAL"):
+        start_metrics_logger(float(os.environ["METRICS_LOG_INTERVAL"]), path=os.environ.get("METRICS_LOG_PATH"))
     demo.launch()
\ No newline at end of file
@@ -0,0 +1,369 @@
+"""
+Benchmark suite of the hot paths of the app: word alignment (cold and warm model,
+sentence lengths, batch sizes, thread counts), the four PoS taggers, the text normalization
+and the translation (through a local LibreTranslate compatible stub, so no network is used).
+
+Every case reports its throughput, p50/p95/p99 latency, and the peak RSS of the process during the case
+and its growth over the RSS at the start of the case (sampled from a thread), as JSON.
+With `--baseline`, the results are compared with a previous run and the cases whose throughput dropped,
+p95 latency grew, or RSS growth grew (by more than a fraction of the peak RSS) by more than `--tolerance`
+are reported as regressions.
+
+Example:
+    python benchmarks/run_benchmarks.py --model bert-base-multilingual-cased --output bench.json
+    python benchmarks/run_benchmarks.py --baseline bench.json --fail-on-regression
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import resource
+import asyncio
+import argparse
+import platform
+import tempfile
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# the translation cache of the benchmark must not reuse (or fill) the one of the app
+os.environ.setdefault("TRANSLATION_CACHE_PATH", os.path.join(tempfile.mkdtemp(), "translation_cache.sqlite"))
+
+from text_preprocess_benchmark import SAMPLE_LINES
+
+
+SECTIONS = ["alignment", "taggers", "preprocess", "translation"]
+
+TAGGERS = ["spaCy", "NLTK", "Flair", "TextBlob"]
+
+BANGLA_WORDS = "আমি তুমি সে বাংলাদেশ দক্ষিণ এশিয়ার একটি সার্বভৌম রাষ্ট্র ভাষা মানুষ বই পড়ি আজ কাল ভালো বড় ছোট শহর গ্রাম নদী ।".split()
+ENGLISH_WORDS = "I you he Bangladesh is a sovereign state in South Asia language people book read today tomorrow good big small city village river .".split()
+
+
+def get_peak_rss_mb():
+    """
+    Peak resident set size of the process (in MB)
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / 1024 ** 2 if sys.platform == "darwin" else peak / 1024
+
+
+def get_rss_mb():
+    """
+    Current resident set size of the process (in MB), the peak so far where /proc is not available
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * resource.getpagesize() / 1024 ** 2
+    except OSError:
+        return get_peak_rss_mb()
+
+
+class RssSampler:
+    """
+    Sample the RSS of the process from a thread every `interval` seconds, to get the peak RSS of a case
+    """
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.start_mb = get_rss_mb()
+        self.peak_mb = self.start_mb
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            self.peak_mb = max(self.peak_mb, get_rss_mb())
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+        self.peak_mb = max(self.peak_mb, get_rss_mb())
+        return {"peak_rss_mb": self.peak_mb, "rss_growth_mb": self.peak_mb - self.start_mb}
+
+
+def get_pairs(num_pairs, num_words, seed=0):
+    """
+    Random (Bangla, English) sentence pairs of `num_words` words, never repeated,
+    so that the embedding cache does not hide the encoding time
+    """
+    rng = random.Random(seed)
+    return [
+        (" ".join(rng.choices(BANGLA_WORDS, k=num_words)) + f" {k}",
+         " ".join(rng.choices(ENGLISH_WORDS, k=num_words)) + f" {k}")
+        for k in range(num_pairs)]
+
+
+def summarize(latencies, items_per_call=1):
+    """
+    Throughput (items per second) and p50/p95/p99 latency (in ms per call) of a list of call latencies
+    """
+    latencies = np.asarray(latencies, dtype=np.float64)
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) * 1000
+    return {
+        "calls": len(latencies),
+        "throughput": items_per_call * len(latencies) / latencies.sum() if latencies.sum() > 0 else 0.0,
+        "p50_ms": p50,
+        "p95_ms": p95,
+        "p99_ms": p99,
+    }
+
+
+def measure(function, inputs, items_per_call=1, warmup=0):
+    """
+    Call `function` on every input and summarize the latencies of the calls
+    (after `warmup` untimed calls on the first inputs)
+    """
+    for value in inputs[:warmup]:
+        function(value)
+
+    latencies = []
+    for value in inputs:
+        start = time.perf_counter()
+        function(value)
+        latencies.append(time.perf_counter() - start)
+    return summarize(latencies, items_per_call)
+
+
+def run_case(results, name, function):
+    """
+    Run a benchmark case, recording its error instead of stopping the suite
+    (e.g. when a tagger model is not provisioned)
+    """
+    sampler = RssSampler()
+    try:
+        results[name] = function()
+    except Exception as e:
+        results[name] = {"error": f"{type(e).__name__}: {' '.join(str(e).split())[:200]}"}
+    memory = sampler.stop()
+    if "error" not in results[name]:
+        results[name].update(memory)
+    print(f"{name:<40} {format_result(results[name])}", file=sys.stderr)
+
+
+def format_result(result):
+    if "error" in result:
+        return result["error"]
+    return (f"{result['throughput']:>12,.1f}/s  p50 {result['p50_ms']:>9.3f} ms  "
+            f"p95 {result['p95_ms']:>9.3f} ms  p99 {result['p99_ms']:>9.3f} ms  "
+            f"rss {result['peak_rss_mb']:,.0f} MB (+{result['rss_growth_mb']:,.0f})")
+
+
+def benchmark_alignment(results, model_name, calls, lengths, batch_sizes, thread_counts, pairs_per_batch):
+    import torch
+    from helper.model_loaders import clear_model_cache
+    from helper.alignment_mappers import get_alignment_mapping, align_batch
+
+    def cold():
+        latencies = []
+        for source, target in get_pairs(3, 12, seed=1):
+            clear_model_cache()
+            start = time.perf_counter()
+            get_alignment_mapping(source, target, model_name)
+            latencies.append(time.perf_counter() - start)
+        return summarize(latencies)
+
+    run_case(results, "alignment/cold", cold)
+
+    for num_words in lengths:
+        pairs = get_pairs(calls, num_words, seed=num_words)
+        run_case(results, f"alignment/warm/words={num_words}", lambda: measure(
+            lambda pair: get_alignment_mapping(pair[0], pair[1], model_name), pairs))
+
+    def batched(batch_size, seed):
+        batches = [get_pairs(pairs_per_batch, 20, seed=seed + k) for k in range(max(calls // 10, 3))]
+        return measure(
+            lambda pairs: align_batch(pairs, model_name=model_name, batch_size=batch_size, use_cache=False),
+            batches, items_per_call=pairs_per_batch)
+
+    for batch_size in batch_sizes:
+        run_case(results, f"alignment/batch_size={batch_size}", lambda: batched(batch_size, 1000))
+
+    num_threads = torch.get_num_threads()
+    try:
+        for threads in thread_counts:
+            torch.set_num_threads(threads)
+            run_case(results, f"alignment/threads={threads}", lambda: batched(max(batch_sizes), 2000))
+    finally:
+        torch.set_num_threads(num_threads)
+
+
+def benchmark_taggers(results, model_name, calls):
+    from helper.pos_taggers import select_pos_tagger
+
+    pairs = get_pairs(calls, 15, seed=3000)
+
+    for tagger in TAGGERS:
+        def tag():
+            # the first call loads the tagger
+            select_pos_tagger(pairs[0][0], pairs[0][1], model_name, tagger)
+            return measure(lambda pair: select_pos_tagger(pair[0], pair[1], model_name, tagger), pairs[1:])
+
+        run_case(results, f"pos_tagger/{tagger}", tag)
+
+
+def benchmark_preprocess(results, calls):
+    from helper.text_preprocess import decontracting_words, space_punc
+    from helper.translators import get_translated_digit
+
+    lines = [SAMPLE_LINES[k % len(SAMPLE_LINES)] for k in range(calls * 100)]
+
+    for name, function in [
+            ("decontracting_words", decontracting_words),
+            ("space_punc", space_punc),
+            ("get_translated_digit", get_translated_digit)]:
+        run_case(results, f"preprocess/{name}", lambda: measure(function, lines, warmup=calls * 10))
+
+
+class _StubTranslationHandler(BaseHTTPRequestHandler):
+    """
+    LibreTranslate compatible /translate endpoint that echoes the text after `latency` seconds
+    """
+    latency = 0.0
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        time.sleep(self.latency)
+        data = json.dumps({"translatedText": request["q"]}).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def benchmark_translation(results, calls, stub_latency_ms):
+    from helper import async_translators
+    from helper.translators import cached_translation, postprocess_translation
+
+    _StubTranslationHandler.latency = stub_latency_ms / 1000
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _StubTranslationHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    async_translators.TRANSLATION_HTTP_URL = f"http://127.0.0.1:{server.server_address[1]}"
+
+    def translate(sentence):
+        return postprocess_translation(
+            cached_translation(sentence, "en", "http", async_translators.http_translation))
+
+    sentences = [source for source, _ in get_pairs(calls, 15, seed=4000)]
+
+    try:
+        # the first pass misses the translation cache, the second one hits it
+        run_case(results, "translation/stub/miss", lambda: measure(translate, sentences))
+        run_case(results, "translation/stub/hit", lambda: measure(translate, sentences))
+
+        # without rate limit, so that the case measures the concurrency of the service
+        concurrent = [source for source, _ in get_pairs(calls, 15, seed=5000)]
+        service = async_translators.AsyncTranslationService(providers=["http"], rate_limits={"http": 0})
+        run_case(results, "translation/stub/concurrent", lambda: measure(
+            lambda sentences: asyncio.run(service.translate_many(sentences, "en")),
+            [concurrent], items_per_call=len(concurrent)))
+        service.close()
+    finally:
+        server.shutdown()
+
+
+def compare(results, baseline, tolerance):
+    """
+    Relative change of the throughput and p95 latency, and change of the RSS growth (relative to the
+    peak RSS), of every case present in both runs, and the list of the cases that regressed by more than `tolerance`
+    """
+    comparison = {}
+    regressions = []
+
+    for name, result in results.items():
+        previous = baseline.get(name)
+        if previous is None or "error" in result or "error" in previous:
+            continue
+
+        throughput_change = result["throughput"] / previous["throughput"] - 1 if previous["throughput"] else 0.0
+        p95_change = result["p95_ms"] / previous["p95_ms"] - 1 if previous["p95_ms"] else 0.0
+        # baselines of older runs have no RSS growth
+        growth_change = (result["rss_growth_mb"] - previous.get("rss_growth_mb", result["rss_growth_mb"])) / previous["peak_rss_mb"]
+        comparison[name] = {
+            "throughput_change": throughput_change, "p95_change": p95_change, "rss_growth_change": growth_change}
+
+        if throughput_change < -tolerance or p95_change > tolerance or growth_change > tolerance:
+            regressions.append(name)
+
+    return comparison, regressions
+
+
+def get_environment(model_name):
+    import torch
+
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "torch": torch.__version__,
+        "torch_threads": torch.get_num_threads(),
+        "model": model_name,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark suite of the alignment, tagging, preprocessing and translation hot paths")
+    parser.add_argument("--model", default="Google-mBERT (Base-Multilingual)",
+                        help="Model name of the UI or checkpoint (name or local path)")
+    parser.add_argument("--sections", nargs="*", default=SECTIONS, choices=SECTIONS)
+    parser.add_argument("--calls", type=int, default=50, help="Calls per latency case")
+    parser.add_argument("--lengths", type=int, nargs="*", default=[5, 20, 80], help="Sentence lengths (in words)")
+    parser.add_argument("--batch-sizes", type=int, nargs="*", default=[1, 8, 32])
+    parser.add_argument("--threads", type=int, nargs="*", default=[1, 2, 4])
+    parser.add_argument("--pairs-per-batch", type=int, default=64, help="Pairs per call of the batch/thread cases")
+    parser.add_argument("--stub-latency-ms", type=float, default=0.0, help="Latency of the translation stub")
+    parser.add_argument("--output", help="JSON file of the results (default: stdout)")
+    parser.add_argument("--baseline", help="JSON file of a previous run to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.1,
+                        help="Relative throughput drop / p95 growth reported as a regression")
+    parser.add_argument("--fail-on-regression", action="store_true",
+                        help="Exit with status 1 when a case regressed")
+    args = parser.parse_args()
+
+    results = {}
+
+    if "alignment" in args.sections:
+        benchmark_alignment(
+            results, args.model, args.calls, args.lengths, args.batch_sizes, args.threads, args.pairs_per_batch)
+    if "taggers" in args.sections:
+        benchmark_taggers(results, args.model, args.calls)
+    if "preprocess" in args.sections:
+        benchmark_preprocess(results, args.calls)
+    if "translation" in args.sections:
+        benchmark_translation(results, args.calls, args.stub_latency_ms)
+
+    report = {"environment": get_environment(args.model), "results": results}
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)["results"]
+        report["comparison"], regressions = compare(results, baseline, args.tolerance)
+        report["regressions"] = regressions
+
+    data = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(data + "\n")
+    else:
+        print(data)
+
+    if regressions:
+        print(f"Regressions: {', '.join(regressions)}", file=sys.stderr)
+        if args.fail_on_regression:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""
+Micro-benchmark of the text normalization (decontracting_words, space_punc, get_translated_digit)
+against the previous implementation, which rebuilt the contractions dict on every call,
+replaced the suffixes in seven passes and translated the digits char by char.
+
+Example:
+    python benchmarks/text_preprocess_benchmark.py --lines 100000
+"""
+
+import os
+import re
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from helper.text_preprocess import contractions, digit_converter, decontracting_words, space_punc, translate_digits, normalize_many
+
+
+SAMPLE_LINES = [
+    "I'm sure they'll say it's fine, but we can't know what they've done.",
+    "বাংলাদেশের জনসংখ্যা ১৬ কোটি ৫০ লক্ষ (২০২২)।",
+    "He'd've gone if she hadn't said \"no\" - wouldn't you?",
+    "Bangladesh is a sovereign state in South Asia.",
+]
+
+
+def previous_decontracting_words(sentence):
+    contractions_copy = dict(contractions)
+
+    sentence_decontracted = []
+
+    for word in sentence.split():
+        if word in contractions_copy:
+            word = contractions_copy[word]
+
+        sentence_decontracted.append(word)
+
+    sentence = ' '.join(sentence_decontracted)
+    sentence = sentence.replace("'ve", " have")
+    sentence = sentence.replace("n't", " not")
+    sentence = sentence.replace("'re", " are")
+    sentence = sentence.replace("'ll", " will")
+    sentence = sentence.replace("'d", " would")
+    sentence = sentence.replace("'s", " is")
+    sentence = sentence.replace("'m", " am")
+
+    return sentence
+
+
+def previous_space_punc(line):
+    line = re.sub('([.,:;\-।!?"()\'])', r" \1 ", line)
+    line = re.sub("\s{2,}", " ", line)
+    return line
+
+
+def previous_translated_digit(sentence):
+    translated_sentence = []
+    for each_letter in sentence:
+        if each_letter in digit_converter.keys():
+            translated_sentence.append(digit_converter[each_letter])
+        else:
+            translated_sentence.append(each_letter)
+
+    return "".join(each for each in translated_sentence)
+
+
+def time_function(function, lines):
+    start = time.perf_counter()
+    function(lines)
+    return time.perf_counter() - start
+
+
+def run_benchmark(num_lines=100000):
+    """
+    Time the previous and current normalization of `num_lines` lines,
+    returning the lines per second of each and the speedup
+    """
+    lines = [SAMPLE_LINES[k % len(SAMPLE_LINES)] for k in range(num_lines)]
+
+    cases = {
+        "decontracting_words": (
+            lambda lines: [previous_decontracting_words(line) for line in lines],
+            lambda lines: [decontracting_words(line) for line in lines]),
+        "space_punc": (
+            lambda lines: [previous_space_punc(line) for line in lines],
+            lambda lines: [space_punc(line) for line in lines]),
+        "get_translated_digit": (
+            lambda lines: [previous_translated_digit(line) for line in lines],
+            lambda lines: [translate_digits(line) for line in lines]),
+        "pipeline": (
+            lambda lines: [previous_space_punc(previous_decontracting_words(previous_translated_digit(line))) for line in lines],
+            lambda lines: normalize_many(lines, decontract=True)),
+    }
+
+    results = {}
+
+    for name, (previous, current) in cases.items():
+        previous_time = time_function(previous, lines)
+        current_time = time_function(current, lines)
+        results[name] = {
+            "previous_lines_per_second": num_lines / previous_time,
+            "lines_per_second": num_lines / current_time,
+            "speedup": previous_time / current_time,
+        }
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Text normalization micro-benchmark")
+    parser.add_argument("--lines", type=int, default=100000)
+    args = parser.parse_args()
+
+    for name, result in run_benchmark(args.lines).items():
+        print(f"{name:<22} {result['previous_lines_per_second']:>12,.0f} -> "
+              f"{result['lines_per_second']:>12,.0f} lines/s  (x{result['speedup']:.2f})")
+
+
+if __name__ == "__main__":
+    main()
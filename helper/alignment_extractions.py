@@ -0,0 +1,186 @@
+"""
+This module contains the methods that extract the (subword) alignments of a batch of sentence pairs
+from their similarity matrix: intersection, union, grow-diag-final, itermax, optimal transport and argmax.
+All of them work on the same (batch, source length, target length) dot product of the representations,
+so changing the method never runs the model again.
+"""
+
+import torch
+
+
+# Supported extraction methods
+EXTRACTION_METHODS = ["intersection", "union", "grow-diag-final", "itermax", "ot", "argmax"]
+
+
+def get_softmaxes(dot_prod, mask=None):
+    """
+    Get the source-to-target and target-to-source softmax of a (masked) dot product,
+    fully masked rows/columns give NaN, which never passes a threshold
+    """
+    if mask is not None:
+        dot_prod = dot_prod.masked_fill(~mask, float('-inf'))
+
+    softmax_srctgt = torch.nn.Softmax(dim=-1)(dot_prod)
+    softmax_tgtsrc = torch.nn.Softmax(dim=-2)(dot_prod)
+
+    return softmax_srctgt, softmax_tgtsrc
+
+
+def get_intersection(dot_prod, threshold=1e-3, mask=None):
+    """
+    Links above the threshold in both softmax directions
+    """
+    softmax_srctgt, softmax_tgtsrc = get_softmaxes(dot_prod, mask)
+    return (softmax_srctgt > threshold) * (softmax_tgtsrc > threshold)
+
+
+def get_union(dot_prod, threshold=1e-3, mask=None):
+    """
+    Links above the threshold in at least one softmax direction
+    """
+    softmax_srctgt, softmax_tgtsrc = get_softmaxes(dot_prod, mask)
+    return (softmax_srctgt > threshold) | (softmax_tgtsrc > threshold)
+
+
+def get_grow_diag_final(dot_prod, threshold=1e-3, mask=None):
+    """
+    Start from the intersection, grow it with the union links that are neighbours (diagonals included)
+    of a link and cover an unaligned source or target token, then add the remaining union links
+    that cover an unaligned token (final-or).\n
+    Every step adds all its candidate links at once, instead of one by one
+    """
+    softmax_srctgt, softmax_tgtsrc = get_softmaxes(dot_prod, mask)
+    forward = softmax_srctgt > threshold
+    backward = softmax_tgtsrc > threshold
+
+    alignment = forward & backward
+    union = forward | backward
+
+    def get_uncovered(alignment):
+        # links whose source or target token is not aligned yet
+        return ~alignment.any(-1, keepdim=True) | ~alignment.any(-2, keepdim=True)
+
+    while True:
+        neighbours = torch.nn.functional.max_pool2d(
+            alignment.unsqueeze(1).float(), kernel_size=3, stride=1, padding=1).squeeze(1).bool()
+        candidates = union & neighbours & ~alignment & get_uncovered(alignment)
+        if not candidates.any():
+            break
+        alignment = alignment | candidates
+
+    return alignment | (union & get_uncovered(alignment))
+
+
+def get_argmax(dot_prod, threshold=None, mask=None):
+    """
+    Links that are the best target of their source token and the best source of their target token
+    """
+    if mask is not None:
+        dot_prod = dot_prod.masked_fill(~mask, float('-inf'))
+
+    forward = torch.zeros_like(dot_prod, dtype=torch.bool).scatter_(
+        -1, dot_prod.argmax(-1, keepdim=True), True)
+    backward = torch.zeros_like(dot_prod, dtype=torch.bool).scatter_(
+        -2, dot_prod.argmax(-2, keepdim=True), True)
+
+    alignment = forward & backward
+    return alignment & mask if mask is not None else alignment
+
+
+def get_itermax(dot_prod, threshold=None, mask=None, max_count=2, alpha=0.9):
+    """
+    Argmax, then `max_count - 1` more argmax rounds over the similarities of the unaligned tokens
+    (Jalili Sabet et al., 2020, SimAlign).\n
+    The similarity is the product of the two softmax directions
+    """
+    if mask is None:
+        mask = torch.ones_like(dot_prod, dtype=torch.bool)
+
+    softmax_srctgt, softmax_tgtsrc = get_softmaxes(dot_prod, mask)
+    similarity = torch.nan_to_num(softmax_srctgt * softmax_tgtsrc).masked_fill(~mask, 0)
+
+    valid_rows = mask.any(-1, keepdim=True).float()
+    valid_columns = mask.any(-2, keepdim=True).float()
+
+    alignment = get_argmax(similarity, mask=mask).float()
+
+    # pairs with a sentence of at most two tokens keep the argmax links
+    active = torch.minimum(valid_rows.sum((-1, -2)), valid_columns.sum((-1, -2))) > 2
+
+    for _ in range(max_count - 1):
+        unaligned_rows = (1 - alignment.sum(-1, keepdim=True).clamp(0, 1)) * valid_rows
+        unaligned_columns = (1 - alignment.sum(-2, keepdim=True).clamp(0, 1)) * valid_columns
+
+        weights = (alpha * unaligned_rows + alpha * unaligned_columns).clamp(0, 1)
+        allowed = 1 - (1 - unaligned_rows) * (1 - unaligned_columns)
+
+        keep = (active & (unaligned_rows.sum((-1, -2)) >= 1) & (unaligned_columns.sum((-1, -2)) >= 1)).float()
+        weights = weights * keep.view(-1, 1, 1)
+        allowed = allowed * keep.view(-1, 1, 1)
+
+        new_alignment = get_argmax(similarity * weights, mask=mask).float() * allowed
+        if not new_alignment.any():
+            break
+        alignment = (alignment + new_alignment).clamp(0, 1)
+
+    return alignment.bool()
+
+
+def get_optimal_transport(dot_prod, threshold=1e-3, mask=None, num_iterations=20):
+    """
+    Entropic optimal transport plan between the source and target tokens (uniform marginals),
+    computed with log-domain Sinkhorn iterations, and the links above the threshold in both its
+    row-normalized and column-normalized versions.\n
+    The first row normalization of the plan is the source-to-target softmax,
+    so the iterations balance the intersection heuristic
+    """
+    if mask is None:
+        mask = torch.ones_like(dot_prod, dtype=torch.bool)
+
+    # finite padding, so that no row or column is only -inf
+    log_kernel = dot_prod.masked_fill(~mask, -1e9)
+
+    valid_rows = mask.any(-1)
+    valid_columns = mask.any(-2)
+    log_a = torch.log(valid_rows.float() / valid_rows.sum(-1, keepdim=True).clamp(min=1))
+    log_b = torch.log(valid_columns.float() / valid_columns.sum(-1, keepdim=True).clamp(min=1))
+
+    f = torch.zeros_like(log_a)
+    g = torch.zeros_like(log_b)
+
+    for _ in range(num_iterations):
+        f = log_a - torch.logsumexp(log_kernel + g.unsqueeze(-2), dim=-1)
+        g = log_b - torch.logsumexp(log_kernel + f.unsqueeze(-1), dim=-2)
+
+    log_plan = log_kernel + f.unsqueeze(-1) + g.unsqueeze(-2)
+
+    plan_srctgt = torch.softmax(log_plan, dim=-1)
+    plan_tgtsrc = torch.softmax(log_plan, dim=-2)
+
+    return (plan_srctgt > threshold) & (plan_tgtsrc > threshold) & mask
+
+
+extraction_functions = {
+    "intersection": get_intersection,
+    "union": get_union,
+    "grow-diag-final": get_grow_diag_final,
+    "itermax": get_itermax,
+    "ot": get_optimal_transport,
+    "argmax": get_argmax,
+}
+
+
+def extract_alignments(dot_prod, method="intersection", threshold=1e-3, mask_src=None, mask_tgt=None):
+    """
+    Extract the boolean (batch, source length, target length) alignments of a batched dot product
+    with one of the `EXTRACTION_METHODS` (argmax and itermax ignore the threshold),
+    masked so that padding never aligns
+    """
+    if method not in extraction_functions:
+        raise ValueError(f"Unknown extraction method: {method}")
+
+    mask = None
+    if mask_src is not None and mask_tgt is not None:
+        mask = mask_src.unsqueeze(-1) & mask_tgt.unsqueeze(-2)
+
+    return extraction_functions[method](dot_prod, threshold=threshold, mask=mask)
@@ -2,14 +2,16 @@
 This module contains the helper functions to get the word alignment mapping between two sentences.
 """
 
+import os
+import time
 import torch
 import itertools
-import transformers
-from transformers import logging
 
-# Set the verbosity to error, so that the warning messages are not printed
-logging.set_verbosity_warning()
-logging.set_verbosity_error()
+from .model_loaders import load_model_and_tokenizer, get_cache_key, get_num_hidden_layers
+from .embedding_cache import get_embedding_key, get_cached_embedding, cache_embedding
+from .metrics import span, increment
+from .alignment_extractions import EXTRACTION_METHODS, extract_alignments
+from .alignment_results import AlignmentResult, render_html, get_accuracy, render_word_mapping, render_word_index_mapping
 
 
 def select_model(model_name):
@@ -30,156 +32,441 @@ def select_model(model_name):
     return model_name
 
 
-def get_alignment_mapping(source="", target="", model_name=""):
+# Hidden layer used for the alignment of each model
+align_layer_dict = {
+    "bert-base-multilingual-cased": 8,
+    "musfiqdehan/bn-en-word-aligner": 8,
+    "csebuetnlp/banglabert_large": 8,
+    "sagorsarker/bangla-bert-base": 8,
+    "sentence-transformers/LaBSE": 8,
+}
+
+
+def select_align_layer(model_name):
     """
-    Get Aligned Words
+    Select the alignment layer of a model
     """
     model_name = select_model(model_name)
+    return align_layer_dict[model_name] if model_name in align_layer_dict else 8
 
-    model = transformers.BertModel.from_pretrained(model_name)
-    tokenizer = transformers.BertTokenizer.from_pretrained(model_name)
 
-    # pre-processing
-    sent_src, sent_tgt = source.strip().split(), target.strip().split()
+# Encoder backend of each model (fp32, int8, bf16 or onnx), ENCODER_BACKEND overrides it for every model
+encoder_backend_dict = {
+    "bert-base-multilingual-cased": "fp32",
+    "musfiqdehan/bn-en-word-aligner": "fp32",
+    "csebuetnlp/banglabert_large": "fp32",
+    "sagorsarker/bangla-bert-base": "fp32",
+    "sentence-transformers/LaBSE": "fp32",
+}
+
+
+def select_encoder_backend(model_name):
+    """
+    Select the encoder backend of a model
+    """
+    if os.environ.get("ENCODER_BACKEND"):
+        return os.environ["ENCODER_BACKEND"]
+    model_name = select_model(model_name)
+    return encoder_backend_dict[model_name] if model_name in encoder_backend_dict else "fp32"
+
+
+def get_sentence_ids(tokenizer, sentence, truncation=True):
+    """
+    Get the words, input ids and subword to word map of a sentence
+    """
+    words = sentence.strip().split()
+
+    tokens = [tokenizer.tokenize(word) for word in words]
+
+    wids = [tokenizer.convert_tokens_to_ids(x) for x in tokens]
+
+    ids = tokenizer.prepare_for_model(list(itertools.chain(*wids)), return_tensors='pt', model_max_length=tokenizer.model_max_length, truncation=truncation)['input_ids']
+
+    # index of the word of every subword, e.g. [0, 0, 1, 2, 2, 2]
+    sub2word_map = torch.repeat_interleave(
+        torch.arange(len(tokens)), torch.tensor([len(word_list) for word_list in tokens], dtype=torch.long))
+
+    return words, ids, sub2word_map
+
+
+def get_sentences_ids(tokenizer, sentences, truncation=True):
+    """
+    Get the words, input ids and subword to word maps of many sentences
+    with a single call of a fast (Rust) tokenizer on the pre-split words
+    """
+    if not tokenizer.is_fast:
+        return [get_sentence_ids(tokenizer, sentence, truncation=truncation) for sentence in sentences]
+
+    words_list = [sentence.strip().split() for sentence in sentences]
+
+    encodings = tokenizer(words_list, is_split_into_words=True, truncation=truncation)
+
+    results = []
+
+    for k, words in enumerate(words_list):
+        ids = torch.tensor(encodings['input_ids'][k], dtype=torch.long)
+
+        # the special tokens have no word index
+        sub2word_map = torch.tensor(
+            [i for i in encodings.word_ids(k) if i is not None], dtype=torch.long)
+
+        results.append((words, ids, sub2word_map))
+
+    return results
+
+
+def pad_sequences(sequences, padding_value=0):
+    """
+    Pad a list of tensors of shape (len, *) into one (batch, max_len, *) tensor
+    and return it along with the boolean mask of the real positions
+    """
+    max_len = max([len(seq) for seq in sequences] + [1])
+
+    padded = sequences[0].new_full(
+        (len(sequences), max_len) + tuple(sequences[0].shape[1:]), padding_value)
+    mask = torch.zeros((len(sequences), max_len), dtype=torch.bool)
+
+    for row, seq in enumerate(sequences):
+        padded[row, :len(seq)] = seq
+        mask[row, :len(seq)] = True
+
+    return padded, mask
+
+
+def get_windows(ids, max_length, window_overlap=128):
+    """
+    Cut the input ids of a sentence longer than `max_length` into overlapping windows
+    of at most `max_length` ids, each wrapped in its own [CLS] and [SEP].
+    The overlap is clamped to half a window, so that the windows always advance by half a window or more.\n
+    Returns a list of (offset of the window in the sentence without [CLS], window ids)
+    """
+    if len(ids) <= max_length:
+        return [(0, ids)]
+
+    content = ids[1:-1]
+    window = max_length - 2
+    step = window - min(window_overlap, window // 2)
+
+    offsets = list(range(0, len(content) - window, step)) + [len(content) - window]
+
+    return [(offset, torch.cat([ids[:1], content[offset:offset + window], ids[-1:]])) for offset in offsets]
+
+
+def encode_sentences(model, tokenizer, ids_list, align_layer=8, batch_size=32, model_name=None, window_overlap=128):
+    """
+    Encode a list of input ids in padded, length-bucketed batches
+    and return the align layer representations of each sentence (without [CLS] and [SEP]).\n
+    If the model is truncated to `align_layer` layers, only its last hidden state is computed.
+    If `model_name` is given, the representations are looked up in (and added to) the
+    embedding cache, and repeated sentences are encoded once.
+    Sentences longer than the model limit are encoded in windows overlapping by
+    `window_overlap` tokens, and the overlapping representations are averaged
+    """
+    truncated = model.config.num_hidden_layers == align_layer
+
+    # sentences longer than the model limit are cut into overlapping windows
+    max_length = min(tokenizer.model_max_length, model.config.max_position_embeddings)
+
+    outputs = [None] * len(ids_list)
+
+    keys = [None] * len(ids_list)
+    pending = {}
+
+    for k, ids in enumerate(ids_list):
+        if model_name is not None:
+            keys[k] = get_embedding_key(
+                model_name, align_layer, ids, window_overlap if len(ids) > max_length else None)
+            outputs[k] = get_cached_embedding(keys[k])
+        if outputs[k] is None:
+            pending.setdefault(keys[k] if model_name is not None else k, []).append(k)
+
+    # encode one sentence per group of identical sentences
+    to_encode = [group[0] for group in pending.values()]
+    increment("align.sentences_encoded", len(to_encode))
+
+    segments = []
+
+    for k in to_encode:
+        for offset, ids in get_windows(ids_list[k], max_length, window_overlap):
+            segments.append((k, offset, ids))
+
+    # sort by length so that every batch holds segments of similar length
+    segments.sort(key=lambda segment: len(segment[2]))
+
+    sums = {}
+    counts = {}
+
+    for start in range(0, len(segments), batch_size):
+        bucket = segments[start:start + batch_size]
+
+        input_ids, attention_mask = pad_sequences(
+            [ids for _, _, ids in bucket], padding_value=tokenizer.pad_token_id)
+
+        increment("align.forward_passes")
+        with torch.no_grad():
+            if truncated:
+                hidden = model(input_ids, attention_mask=attention_mask.long())[0]
+            else:
+                hidden = model(input_ids, attention_mask=attention_mask.long(), output_hidden_states=True)[
+                    2][align_layer]
+
+        # the bf16 backend returns bf16 representations
+        hidden = hidden.float()
 
-    token_src, token_tgt = [tokenizer.tokenize(word) for word in sent_src], [
-        tokenizer.tokenize(word) for word in sent_tgt]
-    
-    wid_src, wid_tgt = [tokenizer.convert_tokens_to_ids(x) for x in token_src], [
-        tokenizer.convert_tokens_to_ids(x) for x in token_tgt]
-    
-    ids_src, ids_tgt = tokenizer.prepare_for_model(list(itertools.chain(*wid_src)), return_tensors='pt', model_max_length=tokenizer.model_max_length, truncation=True)['input_ids'], tokenizer.prepare_for_model(list(itertools.chain(*wid_tgt)), return_tensors='pt', truncation=True, model_max_length=tokenizer.model_max_length)['input_ids']
-    sub2word_map_src = []
+        for row, (k, offset, ids) in enumerate(bucket):
+            out = hidden[row, 1:len(ids) - 1]
 
-    for i, word_list in enumerate(token_src):
-        sub2word_map_src += [i for x in word_list]
+            if len(ids) == len(ids_list[k]):
+                outputs[k] = out
+                continue
 
-    sub2word_map_tgt = []
+            # stitch the windows back together, averaging the overlaps
+            if k not in sums:
+                sums[k] = out.new_zeros((len(ids_list[k]) - 2, out.shape[-1]))
+                counts[k] = out.new_zeros((len(ids_list[k]) - 2, 1))
+            sums[k][offset:offset + len(out)] += out
+            counts[k][offset:offset + len(out)] += 1
 
-    for i, word_list in enumerate(token_tgt):
-        sub2word_map_tgt += [i for x in word_list]
+    for k in sums:
+        outputs[k] = sums[k] / counts[k]
+
+    if model_name is not None:
+        for k in to_encode:
+            cache_embedding(keys[k], outputs[k])
+
+    for group in pending.values():
+        for k in group[1:]:
+            outputs[k] = outputs[group[0]]
+
+    return outputs
+
+
+def get_word_alignments(softmax_inter, sub2word_src, sub2word_tgt, num_words_src, num_words_tgt):
+    """
+    Reduce a batch of subword alignments (batch, src_len, tgt_len) into word alignments
+    (batch, num_words_src, num_words_tgt) with scatter-max over the subword to word maps.\n
+    The padding subwords must be mapped to the word index `num_words_src` / `num_words_tgt`,
+    which is dropped from the result
+    """
+    batch, src_len, tgt_len = softmax_inter.shape
+    softmax_inter = softmax_inter.to(torch.uint8)
+
+    # (batch, src_len, num_words_tgt + 1)
+    src_tgt_words = softmax_inter.new_zeros((batch, src_len, num_words_tgt + 1)).scatter_reduce(
+        2, sub2word_tgt.unsqueeze(1).expand(batch, src_len, tgt_len), softmax_inter, reduce="amax")
+
+    # (batch, num_words_src + 1, num_words_tgt + 1)
+    word_alignments = softmax_inter.new_zeros((batch, num_words_src + 1, num_words_tgt + 1)).scatter_reduce(
+        1, sub2word_src.unsqueeze(2).expand(batch, src_len, num_words_tgt + 1), src_tgt_words, reduce="amax")
+
+    return word_alignments[:, :num_words_src, :num_words_tgt].bool()
+
+
+def get_align_words(align_pairs):
+    """
+    Get the set of (source word, target word) tuples of an (n, 2) tensor of aligned word pairs
+    """
+    return set(map(tuple, align_pairs.tolist()))
+
+
+def align_batch(pairs, model_name="", batch_size=32, align_layer=None, threshold=1e-3, truncate_encoder=True, output="set", window_overlap=128, backend=None, use_cache=True, extraction="intersection"):
+    """
+    Get Aligned Words of many (source, target) sentence pairs,
+    encoding all the sentences together in padded forward passes.\n
+    By default the encoder is truncated to the alignment layer of the model,
+    so the layers above it are neither loaded nor run.\n
+    The alignment of each pair is returned as a set of (i, j) tuples (`output="set"`),
+    an int32 tensor of sorted (i, j) pairs (`output="pairs"`)
+    or a boolean (source words, target words) matrix (`output="matrix"`).\n
+    Sentences longer than the model limit are encoded in overlapping windows instead of being
+    truncated; with `window_overlap=None` they are truncated and their last words never align.\n
+    `backend` selects the encoder backend (fp32, int8, bf16 or onnx, see `select_encoder_backend`).\n
+    `extraction` is one of the `EXTRACTION_METHODS` (intersection, union, grow-diag-final, itermax, ot, argmax),
+    or a list of them, in which case the alignment of each pair is a dict of the alignment of every method,
+    all extracted from the same similarity matrix.
+    With the embedding cache, aligning the same pairs again with another method, threshold
+    or (already encoded) layer does not run the model
+    """
+    methods = [extraction] if isinstance(extraction, str) else list(extraction)
+    for method in methods:
+        if method not in EXTRACTION_METHODS:
+            raise ValueError(f"Unknown extraction method: {method}")
+
+    model_name = select_model(model_name)
+
+    if align_layer is None:
+        align_layer = select_align_layer(model_name)
+
+    # a larger layer would be added to the checkpoint with random weights
+    num_hidden_layers = get_num_hidden_layers(model_name)
+    if isinstance(align_layer, bool) or not isinstance(align_layer, int) or not 1 <= align_layer <= num_hidden_layers:
+        raise ValueError(f"align_layer must be between 1 and {num_hidden_layers} for {model_name}, got {align_layer}")
+
+    if backend is None:
+        backend = select_encoder_backend(model_name)
+
+    with span("align.load_model"):
+        model, tokenizer = load_model_and_tokenizer(
+            model_name, num_layers=align_layer if truncate_encoder else None, backend=backend)
+
+    increment("align.pairs", len(pairs))
+
+    # pre-processing
+    sents, ids_list, sub2word_maps = [], [], []
+
+    sentences = [sentence for pair in pairs for sentence in pair]
+
+    with span("align.tokenize"):
+        for words, ids, sub2word_map in get_sentences_ids(tokenizer, sentences, truncation=window_overlap is None):
+            sents.append(words)
+            ids_list.append(ids)
+            sub2word_maps.append(sub2word_map)
 
     # alignment
-    align_layer = 8
+    with span("align.encode"):
+        outputs = encode_sentences(
+            model, tokenizer, ids_list, align_layer=align_layer, batch_size=batch_size,
+            model_name=get_cache_key(model_name, backend=backend) if use_cache else None,
+            window_overlap=window_overlap or 0)
 
-    threshold = 1e-3
+    results = []
 
-    model.eval()
+    for start in range(0, len(pairs), batch_size):
+        indices = range(start, min(start + batch_size, len(pairs)))
 
-    with torch.no_grad():
-        out_src = model(ids_src.unsqueeze(0), output_hidden_states=True)[
-            2][align_layer][0, 1:-1]
-        out_tgt = model(ids_tgt.unsqueeze(0), output_hidden_states=True)[
-            2][align_layer][0, 1:-1]
+        out_src, mask_src = pad_sequences([outputs[2 * k] for k in indices])
+        out_tgt, mask_tgt = pad_sequences([outputs[2 * k + 1] for k in indices])
 
-        dot_prod = torch.matmul(out_src, out_tgt.transpose(-1, -2))
+        with torch.no_grad(), span("align.extract"):
+            # one similarity matrix for every extraction method
+            dot_prod = torch.matmul(out_src, out_tgt.transpose(-1, -2))
 
-        softmax_srctgt = torch.nn.Softmax(dim=-1)(dot_prod)
-        softmax_tgtsrc = torch.nn.Softmax(dim=-2)(dot_prod)
+            # the maps are cut to the encoded (possibly truncated) length,
+            # and the padding is mapped to a dummy word index
+            num_words_src = max(len(sents[2 * k]) for k in indices)
+            num_words_tgt = max(len(sents[2 * k + 1]) for k in indices)
 
-        softmax_inter = (softmax_srctgt > threshold) * \
-            (softmax_tgtsrc > threshold)
+            sub2word_src, _ = pad_sequences(
+                [sub2word_maps[2 * k][:len(outputs[2 * k])] for k in indices], padding_value=num_words_src)
+            sub2word_tgt, _ = pad_sequences(
+                [sub2word_maps[2 * k + 1][:len(outputs[2 * k + 1])] for k in indices], padding_value=num_words_tgt)
 
-    align_subwords = torch.nonzero(softmax_inter, as_tuple=False)
+            word_alignments = dict(
+                (method, get_word_alignments(
+                    extract_alignments(
+                        dot_prod, method, threshold=threshold, mask_src=mask_src, mask_tgt=mask_tgt),
+                    sub2word_src, sub2word_tgt, num_words_src, num_words_tgt))
+                for method in methods)
 
-    align_words = set()
+        for b, k in enumerate(indices):
+            sent_src, sent_tgt = sents[2 * k], sents[2 * k + 1]
+            align_words = {}
 
-    for i, j in align_subwords:
-        align_words.add((sub2word_map_src[i], sub2word_map_tgt[j]))
+            for method in methods:
+                word_matrix = word_alignments[method][b, :len(sent_src), :len(sent_tgt)]
 
-    return sent_src, sent_tgt, align_words
+                if output == "matrix":
+                    align_words[method] = word_matrix
+                else:
+                    align_words[method] = torch.nonzero(word_matrix, as_tuple=False).to(torch.int32)
+                    if output == "set":
+                        align_words[method] = get_align_words(align_words[method])
 
+            if isinstance(extraction, str):
+                align_words = align_words[extraction]
 
+            results.append((sent_src, sent_tgt, align_words))
 
-def get_word_mapping(source="", target="", model_name=""):
+    return results
+
+
+def get_alignment_error_rate(predicted, reference):
     """
-    Get Word Aligned Mapping Words
+    Get the alignment error rate (AER) of a set of aligned word pairs against a reference set
+    (every reference link is counted as both sure and possible)
     """
-    sent_src, sent_tgt, align_words = get_alignment_mapping(
-        source=source, target=target, model_name=model_name)
+    if not predicted and not reference:
+        return 0.0
+    return 1 - 2 * len(predicted & reference) / (len(predicted) + len(reference))
 
-    result = []
 
-    for i, j in sorted(align_words):
-        result.append(f'bn:({sent_src[i]}) -> en:({sent_tgt[j]})')
+def check_encoder_backend(pairs, model_name="", backend="int8", batch_size=32):
+    """
+    Align sentence pairs with the fp32 encoder and with another backend,
+    and report the AER of the backend alignments against the fp32 ones and the throughput of both
+    """
+    report = {"backend": backend}
+    results = {}
 
-    return result
+    for name in ("fp32", backend):
+        # load the model before timing
+        align_batch(pairs[:1], model_name=model_name, backend=name, use_cache=False)
 
+        start = time.perf_counter()
+        results[name] = align_batch(
+            pairs, model_name=model_name, batch_size=batch_size, backend=name, use_cache=False)
+        report[f"{name}_pairs_per_second"] = len(pairs) / (time.perf_counter() - start)
 
+    error_rates = [
+        get_alignment_error_rate(predicted[2], reference[2])
+        for predicted, reference in zip(results[backend], results["fp32"])]
 
-def get_word_index_mapping(source="", target="", model_name=""):
+    report["aer_delta"] = sum(error_rates) / len(error_rates) if error_rates else 0.0
+    report["max_aer_delta"] = max(error_rates) if error_rates else 0.0
+
+    return report
+
+
+def get_alignment_mapping(source="", target="", model_name="", extraction="intersection", threshold=1e-3, align_layer=None):
     """
-    Get Word Aligned Mapping Index
+    Get Aligned Words\n
+    Another layer than the alignment layer of the model is read from the full encoder,
+    so that every such layer shares one registry entry
     """
-    sent_src, sent_tgt, align_words = get_alignment_mapping(
+    truncate_encoder = align_layer is None or align_layer == select_align_layer(model_name)
+    return align_batch(
+        [(source, target)], model_name=model_name, extraction=extraction,
+        threshold=threshold, align_layer=align_layer, truncate_encoder=truncate_encoder)[0]
+
+
+
+def get_alignment_result(source="", target="", model_name="", get_mapping=get_alignment_mapping):
+    """
+    Get the structured alignment result of a sentence pair, which every renderer can use
+    without running the model again
+    """
+    sent_src, sent_tgt, align_words = get_mapping(
         source=source, target=target, model_name=model_name)
 
-    result = []
+    return AlignmentResult.from_align_words(sent_src, sent_tgt, align_words)
+
+
+def get_word_mapping(source="", target="", model_name=""):
+    """
+    Get Word Aligned Mapping Words
+    """
+    return render_word_mapping(get_alignment_result(
+        source=source, target=target, model_name=model_name))
+
 
-    for i, j in sorted(align_words):
-        result.append(f'bn:({i}) -> en:({j})')
 
-    return result
+def get_word_index_mapping(source="", target="", model_name=""):
+    """
+    Get Word Aligned Mapping Index
+    """
+    return render_word_index_mapping(get_alignment_result(
+        source=source, target=target, model_name=model_name))
 
 
 def get_alignments_table(
         source="", 
         target="", 
-        model_name=""):
+        model_name="",
+        get_mapping=get_alignment_mapping):
     """Get Spacy PoS Tags and return a Markdown table"""
 
-    sent_src, sent_tgt, align_words = get_alignment_mapping(
-        source=source, target=target, model_name=model_name
-    )
-
-    mapped_sent_src = []
-
-    html_table = '''
-                    <table>
-                        <thead>
-                            <th>Source</th>
-                            <th>Target</th>
-                        </thead>
-                '''
-
-    for i, j in sorted(align_words):
-        punc = r"""!()-[]{}।;:'"\,<>./?@#$%^&*_~"""
-        if sent_src[i] in punc or sent_tgt[j] in punc:
-            mapped_sent_src.append(sent_src[i])
-
-            html_table += f'''
-                            <tbody>
-                                <tr>
-                                    <td> {sent_src[i]} </td>
-                                    <td> {sent_tgt[j]} </td>
-                                </tr>
-                            '''
-        else:
-            mapped_sent_src.append(sent_src[i])
-
-            html_table += f'''
-                            <tr>
-                                <td> {sent_src[i]} </td>
-                                <td> {sent_tgt[j]} </td>
-                            </tr>
-                            '''
-
-    unks = list(set(sent_src).difference(set(mapped_sent_src)))
-    for word in unks:
-
-        html_table += f'''
-                        <tr>
-                            <td> {word} </td>
-                            <td> N/A </td>
-                        </tr>                         
-                    '''
-        
-    html_table += '''
-                        </tbody>
-                    </table>
-                '''
-    
-    pos_accuracy = ((len(sent_src) - len(unks)) / len(sent_src))
-    pos_accuracy = f"{pos_accuracy:0.2%}"
-
-    return html_table, pos_accuracy
+    result = get_alignment_result(
+        source=source, target=target, model_name=model_name, get_mapping=get_mapping)
+
+    with span("align.render"):
+        return render_html(result), get_accuracy(result)
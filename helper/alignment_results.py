@@ -0,0 +1,172 @@
+"""
+This module contains the structured result of a sentence pair alignment,
+and the renderers that turn it into HTML, JSON (or a dict), Pharaoh or CSV.
+"""
+
+import io
+import csv
+import html
+import json
+
+import numpy as np
+
+
+punc = r"""!()-[]{}।;:'"\,<>./?@#$%^&*_~"""
+
+
+class AlignmentResult:
+    """
+    Words of both sentences, sorted int32 (source index, target index) pairs
+    and optional per-pair scores of an alignment
+    """
+
+    def __init__(self, source_words, target_words, pairs, scores=None):
+        self.source_words = source_words
+        self.target_words = target_words
+        self.pairs = np.asarray(pairs, dtype=np.int32).reshape(-1, 2)
+        order = np.lexsort((self.pairs[:, 1], self.pairs[:, 0]))
+        self.pairs = self.pairs[order]
+        self.scores = None if scores is None else np.asarray(scores, dtype=np.float32)[order]
+
+    @classmethod
+    def from_align_words(cls, sent_src, sent_tgt, align_words):
+        """
+        Build a result from the (sent_src, sent_tgt, align_words) of `get_alignment_mapping`
+        """
+        return cls(sent_src, sent_tgt, sorted(align_words))
+
+    @property
+    def align_words(self):
+        """
+        Set of (source index, target index) tuples
+        """
+        return set(map(tuple, self.pairs.tolist()))
+
+    @property
+    def source_coverage(self):
+        """
+        Fraction of the source words aligned to at least one target word
+        """
+        if not self.source_words:
+            return 0.0
+        return len(np.unique(self.pairs[:, 0])) / len(self.source_words)
+
+    @property
+    def target_coverage(self):
+        """
+        Fraction of the target words aligned to at least one source word
+        """
+        if not self.target_words:
+            return 0.0
+        return len(np.unique(self.pairs[:, 1])) / len(self.target_words)
+
+    def get_unaligned_source_words(self):
+        """
+        Source words (without repetition) that are never aligned
+        """
+        aligned = set(self.source_words[i] for i in self.pairs[:, 0].tolist())
+        return list(dict.fromkeys(word for word in self.source_words if word not in aligned))
+
+
+def is_punctuation_pair(source_word, target_word):
+    return source_word in punc or target_word in punc
+
+
+def render_html(result, headers=("Source", "Target"), tags=None):
+    """
+    Render an alignment as an HTML table, with an optional PoS tag column (one tag per pair),
+    followed by the unaligned source words
+    """
+    rows = ['<table>', '<thead>']
+    rows += [f'<th>{header}</th>' for header in headers]
+    rows += ['</thead>', '<tbody>']
+
+    for k, (i, j) in enumerate(result.pairs.tolist()):
+        cells = [result.source_words[i], result.target_words[j]]
+        if tags is not None:
+            cells.append(tags[k])
+        rows.append('<tr>' + ''.join(f'<td> {html.escape(cell)} </td>' for cell in cells) + '</tr>')
+
+    for word in result.get_unaligned_source_words():
+        cells = [word, 'N/A'] + (['UNK'] if tags is not None else [])
+        rows.append('<tr>' + ''.join(f'<td> {html.escape(cell)} </td>' for cell in cells) + '</tr>')
+
+    rows += ['</tbody>', '</table>']
+
+    return '\n'.join(rows)
+
+
+def get_accuracy(result):
+    """
+    Share of the distinct source words that are aligned, formatted as a percentage
+    """
+    if not result.source_words:
+        return f"{0:0.2%}"
+    accuracy = (len(result.source_words) - len(result.get_unaligned_source_words())) / len(result.source_words)
+    return f"{accuracy:0.2%}"
+
+
+def render_dict(result, tags=None):
+    """
+    Render an alignment as a JSON serializable dict (e.g. the body of an API response)
+    """
+    data = {
+        "source_words": result.source_words,
+        "target_words": result.target_words,
+        "alignments": result.pairs.tolist(),
+        "source_coverage": result.source_coverage,
+        "target_coverage": result.target_coverage,
+    }
+    if result.scores is not None:
+        data["scores"] = result.scores.tolist()
+    if tags is not None:
+        data["tags"] = tags
+    return data
+
+
+def render_json(result, tags=None):
+    """
+    Render an alignment as a JSON string
+    """
+    return json.dumps(render_dict(result, tags=tags), ensure_ascii=False)
+
+
+def render_pharaoh(result):
+    """
+    Render an alignment in Pharaoh format (e.g. "0-0 1-2 2-1")
+    """
+    return " ".join(f"{i}-{j}" for i, j in result.pairs.tolist())
+
+
+def render_csv(result):
+    """
+    Render an alignment as CSV rows of source index, target index, source word, target word (and score)
+    """
+    output = io.StringIO()
+    writer = csv.writer(output)
+
+    header = ["source_index", "target_index", "source_word", "target_word"]
+    writer.writerow(header + (["score"] if result.scores is not None else []))
+
+    for k, (i, j) in enumerate(result.pairs.tolist()):
+        row = [i, j, result.source_words[i], result.target_words[j]]
+        if result.scores is not None:
+            row.append(float(result.scores[k]))
+        writer.writerow(row)
+
+    return output.getvalue()
+
+
+def render_word_mapping(result, src_lang="bn", tgt_lang="en"):
+    """
+    Render an alignment as a list of "bn:(source word) -> en:(target word)"
+    """
+    return [f'{src_lang}:({result.source_words[i]}) -> {tgt_lang}:({result.target_words[j]})'
+            for i, j in result.pairs.tolist()]
+
+
+def render_word_index_mapping(result, src_lang="bn", tgt_lang="en"):
+    """
+    Render an alignment as a list of "bn:(source index) -> en:(target index)"
+    """
+    return [f'{src_lang}:({i}) -> {tgt_lang}:({j})' for i, j in result.pairs.tolist()]
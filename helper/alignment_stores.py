@@ -0,0 +1,269 @@
+"""
+This module contains a columnar binary store of the word alignments of a corpus, kept in a directory:
+
+    header.json       format version, dtype of the word indices, whether scores are stored
+    offsets.bin       int64, the links of sentence k are the rows offsets[k]:offsets[k + 1] of the links
+    word_counts.bin   int32 (source words, target words) of every sentence
+    links.bin         int16 or int32 (source index, target index) of every link, sorted within a sentence
+    scores.bin        float32 score of every link (optional)
+
+The writer appends whole batches of sentences, and the reader memory-maps the columns,
+so that the alignments of any sentence are read in O(1) and the corpus statistics are vectorized.
+"""
+
+import os
+import json
+
+import numpy as np
+
+
+STORE_VERSION = 1
+
+index_dtypes = {
+    "int16": np.int16,
+    "int32": np.int32,
+}
+
+
+def _get_path(path, column):
+    return os.path.join(path, f"{column}.bin")
+
+
+def _to_links(align_words):
+    """
+    Get the (n, 2) int64 array of links of a set of (i, j) tuples (sorted), an (n, 2) tensor or an array,
+    and the order that sorts it
+    """
+    if isinstance(align_words, (set, frozenset)):
+        align_words = sorted(align_words)
+    links = np.asarray(align_words, dtype=np.int64).reshape(-1, 2)
+    return links, np.lexsort((links[:, 1], links[:, 0]))
+
+
+class AlignmentStoreWriter:
+    """
+    Append sentence alignments to a store (created if needed), buffering `buffer_size` sentences.\n
+    Opening an existing store drops any partially written batch, e.g. one left by a crash
+    """
+
+    def __init__(self, path, index_dtype="int16", scores=False, buffer_size=4096):
+        self.path = path
+        self.buffer_size = buffer_size
+        header_path = os.path.join(path, "header.json")
+
+        if os.path.exists(header_path):
+            with open(header_path, encoding="utf-8") as f:
+                header = json.load(f)
+            self.index_dtype = header["index_dtype"]
+            self.scores = header["scores"]
+        else:
+            if index_dtype not in index_dtypes:
+                raise ValueError(f"Unknown index dtype: {index_dtype}")
+            self.index_dtype = index_dtype
+            self.scores = scores
+            os.makedirs(path, exist_ok=True)
+            with open(header_path, "w", encoding="utf-8") as f:
+                json.dump({"version": STORE_VERSION, "index_dtype": index_dtype, "scores": scores}, f)
+
+        self.num_sentences, self.num_links = self._repair()
+        self.max_index = np.iinfo(index_dtypes[self.index_dtype]).max
+
+        self._offsets = []
+        self._word_counts = []
+        self._links = []
+        self._scores = []
+
+    def _repair(self):
+        """
+        Truncate the columns to the last complete batch (the offsets are written last)
+        """
+        offsets_path = _get_path(self.path, "offsets")
+        if not os.path.exists(offsets_path) or os.path.getsize(offsets_path) < 8:
+            with open(offsets_path, "wb") as f:
+                np.zeros(1, dtype=np.int64).tofile(f)
+            num_sentences, num_links = 0, 0
+        else:
+            num_offsets = os.path.getsize(offsets_path) // 8
+            with open(offsets_path, "r+b") as f:
+                f.truncate(num_offsets * 8)
+            num_sentences = num_offsets - 1
+            num_links = int(np.fromfile(offsets_path, dtype=np.int64, offset=8 * num_sentences)[0])
+
+        itemsize = np.dtype(index_dtypes[self.index_dtype]).itemsize
+        columns = {"word_counts": 8 * num_sentences, "links": 2 * itemsize * num_links}
+        if self.scores:
+            columns["scores"] = 4 * num_links
+
+        for column, size in columns.items():
+            column_path = _get_path(self.path, column)
+            if (os.path.getsize(column_path) if os.path.exists(column_path) else 0) < size:
+                raise ValueError(f"{column_path} is shorter than its offsets, the store is corrupted")
+            with open(column_path, "ab") as f:
+                f.truncate(size)
+
+        return num_sentences, num_links
+
+    def append(self, num_words_src, num_words_tgt, align_words, scores=None):
+        """
+        Append the alignment of a sentence pair: a set of (i, j) tuples, an (n, 2) tensor or array,
+        and the optional score of every link (in the same order, sorted for a set)
+        """
+        links, order = _to_links(align_words)
+        links = links[order]
+        if len(links) and links.max() > self.max_index:
+            raise ValueError(
+                f"Word index {links.max()} does not fit in {self.index_dtype}, create the store with index_dtype='int32'")
+
+        if self.scores:
+            if scores is None:
+                raise ValueError("This store holds the score of every link")
+            self._scores.append(np.asarray(scores, dtype=np.float32).reshape(-1)[order])
+
+        self.num_links += len(links)
+        self.num_sentences += 1
+        self._links.append(links.astype(index_dtypes[self.index_dtype]))
+        self._word_counts.append((num_words_src, num_words_tgt))
+        self._offsets.append(self.num_links)
+
+        if len(self._offsets) >= self.buffer_size:
+            self.flush()
+
+    def append_batch(self, results, scores=None):
+        """
+        Append the (sent_src, sent_tgt, align_words) results of `align_batch` (set or pairs output)
+        """
+        for k, (sent_src, sent_tgt, align_words) in enumerate(results):
+            self.append(len(sent_src), len(sent_tgt), align_words, None if scores is None else scores[k])
+
+    def flush(self):
+        """
+        Write the buffered sentences, their offsets last
+        """
+        if not self._offsets:
+            return
+
+        columns = [
+            ("links", np.concatenate(self._links)),
+            ("word_counts", np.array(self._word_counts, dtype=np.int32)),
+        ]
+        if self.scores:
+            columns.append(("scores", np.concatenate(self._scores)))
+        columns.append(("offsets", np.array(self._offsets, dtype=np.int64)))
+
+        for column, values in columns:
+            with open(_get_path(self.path, column), "ab") as f:
+                values.tofile(f)
+
+        self._offsets, self._word_counts, self._links, self._scores = [], [], [], []
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class AlignmentStore:
+    """
+    Read a store through memory maps: `store[k]` is the (n, 2) array of links of sentence k
+    """
+
+    def __init__(self, path):
+        with open(os.path.join(path, "header.json"), encoding="utf-8") as f:
+            header = json.load(f)
+        if header["version"] > STORE_VERSION:
+            raise ValueError(f"Unsupported alignment store version: {header['version']}")
+
+        self.path = path
+        self.index_dtype = header["index_dtype"]
+
+        # a reader never sees a batch whose offsets are not fully written yet
+        self.offsets = self._map("offsets", np.int64, os.path.getsize(_get_path(path, "offsets")) // 8)
+        num_sentences = len(self.offsets) - 1
+        num_links = int(self.offsets[-1])
+
+        self.word_counts = self._map("word_counts", np.int32, num_sentences * 2).reshape(-1, 2)
+        self.links = self._map("links", index_dtypes[self.index_dtype], num_links * 2).reshape(-1, 2)
+        self.scores = self._map("scores", np.float32, num_links) if header["scores"] else None
+
+    def _map(self, column, dtype, count):
+        if count == 0:
+            return np.zeros(0, dtype=dtype)
+        return np.memmap(_get_path(self.path, column), dtype=dtype, mode="r", shape=(count,))
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, k):
+        if not -len(self) <= k < len(self):
+            raise IndexError(f"sentence {k} out of range")
+        k = k % len(self)
+        return self.links[self.offsets[k]:self.offsets[k + 1]]
+
+    def get_scores(self, k):
+        """
+        Scores of the links of sentence k (None without scores)
+        """
+        if self.scores is None:
+            return None
+        k = k % len(self)
+        return self.scores[self.offsets[k]:self.offsets[k + 1]]
+
+    def get_align_words(self, k):
+        """
+        Set of (i, j) tuples of sentence k, like `get_alignment_mapping`
+        """
+        return set(map(tuple, self[k].tolist()))
+
+    def get_links_per_sentence(self):
+        return np.diff(self.offsets)
+
+    def get_coverage(self, start=0, end=None, chunk_size=1000000):
+        """
+        Get the (source, target) coverage of every sentence of [start, end):
+        the fraction of its words aligned to at least one word (0 for empty sentences),
+        computed chunk by chunk of sentences
+        """
+        end = len(self) if end is None else end
+        coverage = np.zeros((end - start, 2), dtype=np.float32)
+
+        for chunk_start in range(start, end, chunk_size):
+            chunk_end = min(chunk_start + chunk_size, end)
+            offsets = np.asarray(self.offsets[chunk_start:chunk_end + 1])
+            links = np.asarray(self.links[offsets[0]:offsets[-1]], dtype=np.int64)
+            sentences = np.repeat(np.arange(chunk_end - chunk_start), np.diff(offsets))
+
+            for side in (0, 1):
+                # mark the aligned words of the chunk in one flat array of all its words
+                num_words = np.asarray(self.word_counts[chunk_start:chunk_end, side], dtype=np.int64)
+                word_starts = np.cumsum(num_words) - num_words
+                marks = np.zeros(num_words.sum(), dtype=np.int64)
+                marks[word_starts[sentences] + links[:, side]] = 1
+                marked = np.concatenate([[0], np.cumsum(marks)])
+                aligned = marked[word_starts + num_words] - marked[word_starts]
+                coverage[chunk_start - start:chunk_end - start, side] = np.divide(
+                    aligned, num_words, out=np.zeros(len(aligned), dtype=np.float64), where=num_words > 0)
+
+        return coverage
+
+    def get_stats(self):
+        """
+        Corpus statistics: number of sentences and links, mean links per sentence and per source word,
+        mean source/target coverage and number of sentences without any link
+        """
+        links_per_sentence = self.get_links_per_sentence()
+        coverage = self.get_coverage()
+        num_words = np.asarray(self.word_counts, dtype=np.int64).sum(axis=0) if len(self) else np.zeros(2)
+
+        return {
+            "sentences": len(self),
+            "links": int(self.offsets[-1]),
+            "mean_links_per_sentence": float(links_per_sentence.mean()) if len(self) else 0.0,
+            "links_per_source_word": float(self.offsets[-1] / num_words[0]) if num_words[0] else 0.0,
+            "mean_source_coverage": float(coverage[:, 0].mean()) if len(self) else 0.0,
+            "mean_target_coverage": float(coverage[:, 1].mean()) if len(self) else 0.0,
+            "unaligned_sentences": int((links_per_sentence == 0).sum()),
+        }
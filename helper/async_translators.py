@@ -0,0 +1,208 @@
+"""
+This module contains an asyncio translation service that translates many sentences concurrently,
+with bounded concurrency, per-provider rate limiting, timeouts and a fallback chain of providers.
+"""
+
+import os
+import time
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from .translators import get_cached_translation, translate_and_cache
+
+# requests and deep_translator are imported on first use
+from .resources import lazy_import
+
+
+# Base URL of a LibreTranslate compatible HTTP translation server (e.g. a self-hosted one)
+TRANSLATION_HTTP_URL = os.environ.get("TRANSLATION_HTTP_URL", "")
+
+# Default maximum number of requests per second of each provider
+provider_rate_limits = {
+    "google": 10.0,
+    "mymemory": 2.0,
+    "microsoft": 10.0,
+    "yandex": 10.0,
+    "chatgpt": 1.0,
+    "http": 50.0,
+}
+
+_http_session = None
+_http_session_lock = threading.Lock()
+
+# deep_translator objects keep per-request state, so they are reused per thread only
+_translators = threading.local()
+
+
+def get_http_session():
+    """
+    Get (once) the pooled HTTP session of the translation server
+    """
+    global _http_session
+    with _http_session_lock:
+        if _http_session is None:
+            requests = lazy_import("requests")
+            session = requests.Session()
+            session.mount("http://", requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=32))
+            session.mount("https://", requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=32))
+            _http_session = session
+    return _http_session
+
+
+def _get_deep_translator(provider, tgt_lang_code):
+    """
+    Get (once per thread) the deep_translator object of a provider and target language
+    """
+    if not hasattr(_translators, "cache"):
+        _translators.cache = {}
+
+    key = (provider, tgt_lang_code)
+    if key not in _translators.cache:
+        deep_translator = lazy_import("deep_translator")
+        if provider == "google":
+            translator = deep_translator.GoogleTranslator(source='auto', target=tgt_lang_code)
+        elif provider == "mymemory":
+            translator = deep_translator.MyMemoryTranslator(source='auto', target=tgt_lang_code)
+        elif provider == "microsoft":
+            translator = deep_translator.MicrosoftTranslator(
+                source='auto', target=tgt_lang_code, api_key=os.environ.get("MICROSOFT_API_KEY"),
+                region=os.environ.get("MICROSOFT_REGION"))
+        elif provider == "yandex":
+            translator = deep_translator.YandexTranslator(
+                source='auto', target=tgt_lang_code, api_key=os.environ.get("YANDEX_API_KEY"))
+        elif provider == "chatgpt":
+            translator = deep_translator.ChatGptTranslator(
+                source='auto', target=tgt_lang_code, api_key=os.environ.get("OPENAI_API_KEY"))
+        else:
+            raise ValueError(f"Unknown translation provider: {provider}")
+        _translators.cache[key] = translator
+
+    return _translators.cache[key]
+
+
+def http_translation(sentence, tgt_lang_code, timeout=10.0):
+    """
+    Translate a sentence with a LibreTranslate compatible server through the pooled HTTP session
+    """
+    response = get_http_session().post(
+        TRANSLATION_HTTP_URL.rstrip("/") + "/translate",
+        json={"q": sentence, "source": "auto", "target": tgt_lang_code, "format": "text"},
+        timeout=timeout)
+    response.raise_for_status()
+    return response.json()["translatedText"]
+
+
+def get_default_providers():
+    """
+    Get the fallback chain of the providers that can be used with the current environment
+    """
+    providers = []
+    if TRANSLATION_HTTP_URL:
+        providers.append("http")
+    providers += ["google", "mymemory"]
+    if os.environ.get("MICROSOFT_API_KEY"):
+        providers.append("microsoft")
+    if os.environ.get("YANDEX_API_KEY"):
+        providers.append("yandex")
+    if os.environ.get("OPENAI_API_KEY"):
+        providers.append("chatgpt")
+    return providers
+
+
+class RateLimiter:
+    """
+    Space the calls of a provider so that at most `rate` calls start per second
+    """
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self.next_time = 0.0
+        self.lock = asyncio.Lock()
+
+    async def wait(self):
+        async with self.lock:
+            now = time.monotonic()
+            delay = self.next_time - now
+            self.next_time = max(now, self.next_time) + self.interval
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+class AsyncTranslationService:
+    """
+    Translate sentences concurrently, falling back to the next provider of the chain
+    when a provider fails or times out.\n
+    The http provider gets `timeout` as its request timeout, but a timed-out deep_translator call
+    cannot be stopped: it keeps its executor thread until it returns, while the next provider runs
+    """
+
+    def __init__(self, providers=None, max_concurrency=16, timeout=10.0, rate_limits=None):
+        self.providers = list(providers) if providers is not None else get_default_providers()
+        if not self.providers:
+            raise ValueError("The provider chain is empty")
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.rate_limits = dict(provider_rate_limits, **(rate_limits or {}))
+        self.executor = ThreadPoolExecutor(max_workers=max_concurrency)
+        self._semaphore = None
+        self._limiters = None
+
+    def _translate_sync(self, sentence, tgt_lang_code, provider):
+        if provider == "http":
+            translate = lambda text, code: http_translation(text, code, timeout=self.timeout)
+        else:
+            translate = lambda text, code: _get_deep_translator(provider, code).translate(text)
+        return translate_and_cache(sentence, tgt_lang_code, provider, translate)
+
+    async def translate(self, sentence, tgt_lang_code):
+        """
+        Translate a sentence with the first provider of the chain that succeeds
+        """
+        # asyncio primitives are created in the running event loop
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+            self._limiters = dict(
+                (provider, RateLimiter(self.rate_limits.get(provider, 0.0))) for provider in self.providers)
+
+        loop = asyncio.get_running_loop()
+        error = None
+
+        async with self._semaphore:
+            for provider in self.providers:
+                # cache hits neither wait for the rate limiter nor use the executor
+                translated = get_cached_translation(sentence, tgt_lang_code, provider)
+                if translated is not None:
+                    return translated
+
+                await self._limiters[provider].wait()
+                try:
+                    return await asyncio.wait_for(
+                        loop.run_in_executor(
+                            self.executor, self._translate_sync, sentence, tgt_lang_code, provider),
+                        timeout=self.timeout)
+                except Exception as e:
+                    error = e
+
+        raise error
+
+    async def translate_many(self, sentences, tgt_lang_code):
+        """
+        Translate many sentences concurrently, keeping their order
+        """
+        return await asyncio.gather(
+            *[self.translate(sentence, tgt_lang_code) for sentence in sentences])
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+
+
+def translate_many(sentences, tgt_lang_code, **kwargs):
+    """
+    Translate many sentences concurrently (blocking wrapper of AsyncTranslationService)
+    """
+    service = AsyncTranslationService(**kwargs)
+    try:
+        return asyncio.run(service.translate_many(sentences, tgt_lang_code))
+    finally:
+        service.close()
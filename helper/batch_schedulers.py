@@ -0,0 +1,151 @@
+"""
+This module contains a micro-batching scheduler that groups concurrent alignment requests
+by model and aligns each group in one batched forward pass.
+"""
+
+import os
+import time
+import queue
+import threading
+from concurrent.futures import Future
+
+from .alignment_mappers import align_batch, select_model
+from .metrics import profiled, observe, increment, set_gauge
+
+
+# Maximum time (in ms) a request waits for other requests to join its batch
+BATCH_WAIT_MS = float(os.environ.get("BATCH_WAIT_MS", 10))
+
+# Maximum number of requests aligned in one batch
+MAX_BATCH_SIZE = int(os.environ.get("MAX_BATCH_SIZE", 16))
+
+
+class MicroBatchScheduler:
+    """
+    Queue alignment requests and run them in batches of at most `max_batch_size` requests,
+    collected during at most `wait_ms` milliseconds after the first one
+    """
+
+    def __init__(self, wait_ms=BATCH_WAIT_MS, max_batch_size=MAX_BATCH_SIZE, align=align_batch):
+        self.wait = wait_ms / 1000
+        self.max_batch_size = max_batch_size
+        self.align = align
+        self.requests = queue.Queue()
+        self.stats_lock = threading.Lock()
+        self.stats = {
+            "requests": 0,
+            "batches": 0,
+            "max_queue_depth": 0,
+            "batch_sizes": {},
+        }
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def submit(self, source, target, model_name):
+        """
+        Queue an alignment request and return the future of its (sent_src, sent_tgt, align_words)
+        """
+        future = Future()
+        self.requests.put((select_model(model_name), source, target, future, time.monotonic()))
+        queue_depth = self.requests.qsize()
+        with self.stats_lock:
+            self.stats["requests"] += 1
+            self.stats["max_queue_depth"] = max(self.stats["max_queue_depth"], queue_depth)
+            max_queue_depth = self.stats["max_queue_depth"]
+        # also exported through helper.metrics (metrics log, /metrics)
+        increment("scheduler.requests")
+        set_gauge("scheduler.queue_depth", queue_depth)
+        set_gauge("scheduler.max_queue_depth", max_queue_depth)
+        return future
+
+    def _collect(self):
+        batch = [self.requests.get()]
+        deadline = time.monotonic() + self.wait
+
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self.requests.get(timeout=timeout))
+            except queue.Empty:
+                break
+
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+
+            now = time.monotonic()
+            set_gauge("scheduler.queue_depth", self.requests.qsize())
+            for request in batch:
+                observe("scheduler.queue_wait", now - request[4])
+
+            groups = {}
+            for request in batch:
+                groups.setdefault(request[0], []).append(request)
+
+            for model_name, requests in groups.items():
+                with self.stats_lock:
+                    self.stats["batches"] += 1
+                    sizes = self.stats["batch_sizes"]
+                    sizes[len(requests)] = sizes.get(len(requests), 0) + 1
+                increment("scheduler.batches")
+                increment("scheduler.batched_requests", len(requests))
+                increment(f"scheduler.batch_size.{len(requests)}")
+
+                try:
+                    # cProfile only sees its own thread, so the batches are profiled here
+                    with profiled("align_batch"):
+                        results = self.align(
+                            [(source, target) for _, source, target, _, _ in requests], model_name=model_name)
+                except Exception:
+                    # retry the requests one by one, so that only the failing ones get the error
+                    self._run_one_by_one(model_name, requests)
+                    continue
+
+                for (_, _, _, future, _), result in zip(requests, results):
+                    future.set_result(result)
+
+    def _run_one_by_one(self, model_name, requests):
+        for _, source, target, future, _ in requests:
+            try:
+                future.set_result(self.align([(source, target)], model_name=model_name)[0])
+            except Exception as e:
+                future.set_exception(e)
+
+    def get_stats(self):
+        """
+        Get the request/batch counters, queue depth and batch size histogram of the scheduler
+        """
+        with self.stats_lock:
+            stats = dict(self.stats)
+            stats["batch_sizes"] = dict(self.stats["batch_sizes"])
+        stats["queue_depth"] = self.requests.qsize()
+        aligned = sum(size * count for size, count in stats["batch_sizes"].items())
+        stats["mean_batch_size"] = aligned / stats["batches"] if stats["batches"] else 0.0
+        return stats
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler():
+    """
+    Get (and start on first use) the process-wide micro-batching scheduler
+    """
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = MicroBatchScheduler()
+        return _scheduler
+
+
+def get_batched_alignment_mapping(source="", target="", model_name=""):
+    """
+    Get Aligned Words through the micro-batching scheduler
+    (same result as `get_alignment_mapping`)
+    """
+    return get_scheduler().submit(source, target, model_name).result()
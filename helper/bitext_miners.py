@@ -0,0 +1,231 @@
+"""
+This module contains the sentence-level alignment of two documents or corpora:
+LaBSE sentence embeddings, IVF indexes over them and margin-based mining of the parallel sentence pairs
+(Artetxe and Schwenk, 2019), streamed as they are found.
+"""
+
+import os
+import json
+import shutil
+
+import numpy as np
+import torch
+
+from .alignment_mappers import select_model
+from .model_loaders import load_model_and_tokenizer
+from .vector_indexes import IVFIndex
+from .metrics import span, increment
+
+# sentence-transformers is optional, and imported on first use
+from .resources import lazy_import, get_pretrained_kwargs
+
+
+_sentence_encoders = {}
+
+
+def get_sentence_encoder(model_name):
+    """
+    Get (once) the sentence-transformers encoder of a checkpoint (e.g. LaBSE with its dense head),
+    or None when sentence-transformers is not installed
+    """
+    if model_name not in _sentence_encoders:
+        kwargs = get_pretrained_kwargs()
+        try:
+            _sentence_encoders[model_name] = lazy_import("sentence_transformers").SentenceTransformer(
+                model_name, cache_folder=kwargs["cache_dir"], local_files_only=kwargs["local_files_only"])
+        except ImportError:
+            _sentence_encoders[model_name] = None
+    return _sentence_encoders[model_name]
+
+
+def embed_sentences(sentences, model_name="SentenceTransformers-LaBSE (Multilingual)", batch_size=64):
+    """
+    Get the unit sentence embeddings (n, dim) float32 of many sentences,
+    encoding length-sorted padded batches.\n
+    The sentence-transformers pipeline of the checkpoint is used when it is installed,
+    otherwise the normalized [CLS] representation of its last layer
+    """
+    model_name = select_model(model_name)
+
+    with span("mine.embed"):
+        encoder = get_sentence_encoder(model_name)
+        if encoder is not None:
+            return encoder.encode(
+                list(sentences), batch_size=batch_size, convert_to_numpy=True, normalize_embeddings=True)
+
+        model, tokenizer = load_model_and_tokenizer(model_name)
+
+        order = sorted(range(len(sentences)), key=lambda k: len(sentences[k]))
+        embeddings = np.zeros((len(sentences), model.config.hidden_size), dtype=np.float32)
+
+        for start in range(0, len(order), batch_size):
+            bucket = order[start:start + batch_size]
+            inputs = tokenizer(
+                [sentences[k] for k in bucket], padding=True, truncation=True, return_tensors="pt")
+            with torch.no_grad():
+                hidden = model(inputs["input_ids"], attention_mask=inputs["attention_mask"])[0][:, 0].float()
+            embeddings[bucket] = torch.nn.functional.normalize(hidden, dim=-1).numpy()
+
+    return embeddings
+
+
+def embed_to_file(sentences, num_sentences, path, model_name="SentenceTransformers-LaBSE (Multilingual)", batch_size=64, chunk_size=8192, dtype=np.float16):
+    """
+    Embed a stream of `num_sentences` sentences chunk by chunk into a .npy file,
+    and return it memory-mapped
+    """
+    embeddings = None
+    start = 0
+    chunk = []
+
+    def flush(embeddings, start, chunk):
+        vectors = embed_sentences(chunk, model_name=model_name, batch_size=batch_size)
+        if embeddings is None:
+            embeddings = np.lib.format.open_memmap(
+                path, mode="w+", dtype=dtype, shape=(num_sentences, vectors.shape[1]))
+        embeddings[start:start + len(vectors)] = vectors
+        return embeddings
+
+    for sentence in sentences:
+        chunk.append(sentence)
+        if len(chunk) == chunk_size:
+            embeddings = flush(embeddings, start, chunk)
+            start += len(chunk)
+            chunk = []
+
+    if chunk:
+        embeddings = flush(embeddings, start, chunk)
+        start += len(chunk)
+
+    if start != num_sentences:
+        raise ValueError(f"Expected {num_sentences} sentences, got {start}")
+
+    if embeddings is None:
+        # an empty corpus still gets (0, dim) embeddings
+        dim = embed_sentences([""], model_name=model_name, batch_size=batch_size).shape[1]
+        embeddings = np.lib.format.open_memmap(path, mode="w+", dtype=dtype, shape=(0, dim))
+
+    embeddings.flush()
+    return np.load(path, mmap_mode="r")
+
+
+def get_neighbour_means(embeddings, index, k=4, nprobe=8, chunk_size=4096):
+    """
+    Mean similarity of every embedding to its `k` nearest neighbours in an index
+    (the denominator of the margin score)
+    """
+    means = np.zeros(len(embeddings), dtype=np.float32)
+    for start in range(0, len(embeddings), chunk_size):
+        scores, _ = index.search(embeddings[start:start + chunk_size], k=k, nprobe=nprobe)
+        means[start:start + len(scores)] = np.where(np.isfinite(scores), scores, 0).sum(axis=1) / k
+    return means
+
+
+def mine_bitext(src_embeddings, tgt_embeddings, src_index=None, tgt_index=None, k=4, threshold=1.06, nprobe=8, chunk_size=4096):
+    """
+    Stream the (score, source row, target row) of the mined sentence pairs, chunk of source sentences
+    by chunk of source sentences.\n
+    Every source sentence is paired with the candidate (among its `k` nearest target sentences)
+    of highest ratio margin score, cos(x, y) / ((mean_k(x) + mean_k(y)) / 2), and the pairs scoring at
+    least `threshold` are yielded. The indexes are built in memory when they are not given
+    """
+    if len(src_embeddings) == 0 or len(tgt_embeddings) == 0:
+        return
+
+    if src_index is None:
+        src_index = IVFIndex.build(src_embeddings)
+    if tgt_index is None:
+        tgt_index = IVFIndex.build(tgt_embeddings)
+
+    with span("mine.backward_means"):
+        tgt_means = get_neighbour_means(tgt_embeddings, src_index, k=k, nprobe=nprobe, chunk_size=chunk_size)
+
+    for start in range(0, len(src_embeddings), chunk_size):
+        with span("mine.search"):
+            scores, ids = tgt_index.search(src_embeddings[start:start + chunk_size], k=k, nprobe=nprobe)
+
+        found = ids >= 0
+        src_means = np.where(found, scores, 0).sum(axis=1) / k
+        margins = np.where(
+            found, scores / ((src_means[:, None] + tgt_means[np.where(found, ids, 0)]) / 2), -np.inf)
+
+        best = margins.argmax(axis=1)
+        best_margins = margins[np.arange(len(best)), best]
+
+        for row in np.nonzero(best_margins >= threshold)[0]:
+            increment("mine.pairs")
+            yield float(best_margins[row]), start + int(row), int(ids[row, best[row]])
+
+
+def mine_sentences(src_sentences, tgt_sentences, model_name="SentenceTransformers-LaBSE (Multilingual)", k=4, threshold=1.06, batch_size=64):
+    """
+    Align the sentences of two documents: get the (score, source sentence, target sentence)
+    of the mined parallel sentence pairs, in source order
+    """
+    if not src_sentences or not tgt_sentences:
+        return []
+
+    src_embeddings = embed_sentences(src_sentences, model_name=model_name, batch_size=batch_size)
+    tgt_embeddings = embed_sentences(tgt_sentences, model_name=model_name, batch_size=batch_size)
+
+    # documents are small, so the search is exact (a single list)
+    k = min(k, len(src_sentences), len(tgt_sentences))
+    return [
+        (score, src_sentences[i], tgt_sentences[j])
+        for score, i, j in mine_bitext(
+            src_embeddings, tgt_embeddings, IVFIndex.build(src_embeddings, num_lists=1),
+            IVFIndex.build(tgt_embeddings, num_lists=1), k=k, threshold=threshold, nprobe=1)]
+
+
+def get_corpus_metadata(num_sentences, model_name, source_path=None):
+    """
+    Get what identifies the embeddings of a corpus: its size, model and (optionally) its file
+    """
+    metadata = {"num_sentences": num_sentences, "model": select_model(model_name)}
+    if source_path is not None:
+        stat = os.stat(source_path)
+        metadata["source"] = {"path": os.path.abspath(source_path), "size": stat.st_size, "mtime": stat.st_mtime}
+    return metadata
+
+
+def build_corpus_index(sentences, num_sentences, path, model_name="SentenceTransformers-LaBSE (Multilingual)", batch_size=64, num_lists=None, source_path=None):
+    """
+    Embed a corpus into `path/embeddings.npy` and index it into `path/index`,
+    reusing both when they already exist for the same corpus (`path/corpus.json`),
+    and rebuilding them otherwise
+    """
+    os.makedirs(path, exist_ok=True)
+    embeddings_path = os.path.join(path, "embeddings.npy")
+    index_path = os.path.join(path, "index")
+    metadata_path = os.path.join(path, "corpus.json")
+
+    metadata = get_corpus_metadata(num_sentences, model_name, source_path)
+    previous = None
+    if os.path.exists(metadata_path):
+        with open(metadata_path, encoding="utf-8") as f:
+            previous = json.load(f)
+
+    if previous != metadata:
+        # the artifacts of another corpus or model
+        if os.path.exists(embeddings_path):
+            os.remove(embeddings_path)
+        shutil.rmtree(index_path, ignore_errors=True)
+
+    if not os.path.exists(embeddings_path):
+        # an interrupted run leaves a temporary file, never a partial embeddings.npy
+        embed_to_file(sentences, num_sentences, embeddings_path + ".tmp.npy", model_name, batch_size)
+        os.replace(embeddings_path + ".tmp.npy", embeddings_path)
+        with open(metadata_path, "w", encoding="utf-8") as f:
+            json.dump(metadata, f)
+    embeddings = np.load(embeddings_path, mmap_mode="r")
+
+    if len(embeddings) != num_sentences:
+        raise ValueError(f"{embeddings_path} holds {len(embeddings)} embeddings, expected {num_sentences}")
+
+    if os.path.exists(os.path.join(index_path, "index.json")):
+        index = IVFIndex.load(index_path)
+    else:
+        with span("mine.build_index"):
+            index = IVFIndex.build(embeddings, num_lists=num_lists, path=index_path)
+
+    return embeddings, index
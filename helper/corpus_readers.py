@@ -0,0 +1,94 @@
+"""
+This module contains the helper functions to stream parallel corpora line by line.
+"""
+
+import itertools
+
+import numpy as np
+
+
+def read_parallel_files(src_path, tgt_path, encoding="utf-8"):
+    """
+    Stream (source, target) sentence pairs from two line-aligned text files
+    """
+    with open(src_path, encoding=encoding) as src_file, open(tgt_path, encoding=encoding) as tgt_file:
+        for line_no, (src, tgt) in enumerate(itertools.zip_longest(src_file, tgt_file)):
+            if src is None or tgt is None:
+                raise ValueError(
+                    f"{src_path} and {tgt_path} have a different number of lines (line {line_no})")
+            yield src.rstrip("\n"), tgt.rstrip("\n")
+
+
+def read_tsv_file(path, encoding="utf-8"):
+    """
+    Stream (source, target) sentence pairs from a tab separated file
+    """
+    with open(path, encoding=encoding) as tsv_file:
+        for line_no, line in enumerate(tsv_file):
+            columns = line.rstrip("\n").split("\t")
+            if len(columns) != 2:
+                raise ValueError(
+                    f"{path} line {line_no} has {len(columns)} columns instead of 2")
+            yield columns[0], columns[1]
+
+
+def read_lines(path, encoding="utf-8"):
+    """
+    Stream the sentences of a text file, one per line
+    """
+    with open(path, encoding=encoding) as f:
+        for line in f:
+            yield line.rstrip("\n")
+
+
+def get_line_offsets(path):
+    """
+    Get the byte offset of every line of a file, so that any line can be read with a seek
+    """
+    offsets = [0]
+    with open(path, "rb") as f:
+        for line in f:
+            offsets.append(offsets[-1] + len(line))
+    # the last offset is the end of the file
+    return np.array(offsets[:-1], dtype=np.int64)
+
+
+def read_line(f, offset, encoding="utf-8"):
+    """
+    Read the line at a byte offset of a file opened in binary mode
+    """
+    f.seek(offset)
+    return f.readline().decode(encoding).rstrip("\n")
+
+
+def get_batches(iterable, batch_size):
+    """
+    Group an iterable into lists of at most `batch_size` items
+    """
+    iterator = iter(iterable)
+    while True:
+        batch = list(itertools.islice(iterator, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+def count_complete_lines(path):
+    """
+    Count the newline terminated lines of a file, dropping a trailing partial line
+    (e.g. one left by a crash in the middle of a write)
+    """
+    count = 0
+    size = 0
+
+    with open(path, "rb") as f:
+        for line in f:
+            if not line.endswith(b"\n"):
+                break
+            count += 1
+            size += len(line)
+
+    with open(path, "r+b") as f:
+        f.truncate(size)
+
+    return count
@@ -0,0 +1,149 @@
+"""
+This module contains a content-addressed cache of the sentence embeddings used for the alignment,
+with an in-memory LRU tier and an optional memory-mapped on-disk tier (float16).
+"""
+
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import torch
+
+
+# RAM budget (in MB) of the in-memory tier, 0 disables the cache
+EMBEDDING_CACHE_MAX_MB = float(os.environ.get("EMBEDDING_CACHE_MAX_MB", 256))
+
+# Directory of the on-disk tier, empty disables it
+EMBEDDING_CACHE_DIR = os.environ.get("EMBEDDING_CACHE_DIR", "")
+
+_embedding_cache = OrderedDict()
+_embedding_cache_lock = threading.Lock()
+_embedding_cache_stats = {
+    "memory_hits": 0,
+    "disk_hits": 0,
+    "misses": 0,
+    "evictions": 0,
+    "memory_bytes": 0,
+    "disk_bytes_written": 0,
+}
+
+
+def set_embedding_cache_dir(path):
+    """
+    Enable the on-disk tier in `path` (or disable it with an empty path)
+    """
+    global EMBEDDING_CACHE_DIR
+    EMBEDDING_CACHE_DIR = path
+    if path:
+        os.makedirs(path, exist_ok=True)
+
+
+def get_embedding_key(model_name, align_layer, ids, window_overlap=None):
+    """
+    Get the cache key of the embeddings of a sentence from its model, align layer and input ids,
+    and from the window overlap of a sentence encoded in windows
+    """
+    digest = hashlib.sha1(ids.numpy().astype(np.int64).tobytes()).hexdigest()
+    key = f"{model_name}|{align_layer}|{digest}"
+    return key if window_overlap is None else f"{key}|{window_overlap}"
+
+
+def _get_disk_path(key):
+    digest = hashlib.sha1(key.encode("utf-8")).hexdigest()
+    return os.path.join(EMBEDDING_CACHE_DIR, digest[:2], digest + ".npy")
+
+
+def _get_size(embedding):
+    return embedding.numel() * embedding.element_size()
+
+
+def _add_to_memory(key, embedding):
+    if key in _embedding_cache:
+        return
+
+    _embedding_cache[key] = embedding
+    _embedding_cache_stats["memory_bytes"] += _get_size(embedding)
+
+    max_bytes = EMBEDDING_CACHE_MAX_MB * 1024 ** 2
+    while _embedding_cache and _embedding_cache_stats["memory_bytes"] > max_bytes:
+        _, evicted = _embedding_cache.popitem(last=False)
+        _embedding_cache_stats["memory_bytes"] -= _get_size(evicted)
+        _embedding_cache_stats["evictions"] += 1
+
+
+def get_cached_embedding(key):
+    """
+    Get the cached embeddings of a key from memory, then from disk, or None on a miss
+    """
+    if EMBEDDING_CACHE_MAX_MB <= 0:
+        return None
+
+    with _embedding_cache_lock:
+        if key in _embedding_cache:
+            _embedding_cache.move_to_end(key)
+            _embedding_cache_stats["memory_hits"] += 1
+            return _embedding_cache[key]
+
+    if EMBEDDING_CACHE_DIR:
+        path = _get_disk_path(key)
+        if os.path.exists(path):
+            array = np.load(path, mmap_mode="r")
+            embedding = torch.from_numpy(np.asarray(array, dtype=np.float32))
+            with _embedding_cache_lock:
+                _embedding_cache_stats["disk_hits"] += 1
+                _add_to_memory(key, embedding)
+            return embedding
+
+    with _embedding_cache_lock:
+        _embedding_cache_stats["misses"] += 1
+
+    return None
+
+
+def cache_embedding(key, embedding):
+    """
+    Store the embeddings of a key in memory and, if enabled, on disk as float16
+    """
+    if EMBEDDING_CACHE_MAX_MB <= 0:
+        return
+
+    # copy, so that the cache does not keep the whole padded batch alive
+    embedding = embedding.detach().float().clone()
+
+    with _embedding_cache_lock:
+        _add_to_memory(key, embedding)
+
+    if EMBEDDING_CACHE_DIR:
+        path = _get_disk_path(key)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, "wb") as f:
+                np.save(f, embedding.numpy().astype(np.float16))
+            os.replace(tmp_path, path)
+            with _embedding_cache_lock:
+                _embedding_cache_stats["disk_bytes_written"] += os.path.getsize(path)
+
+
+def get_embedding_cache_stats():
+    """
+    Get the hit/miss counters, hit rate and bytes used by the embedding cache
+    """
+    with _embedding_cache_lock:
+        stats = dict(_embedding_cache_stats)
+        stats["memory_entries"] = len(_embedding_cache)
+
+    lookups = stats["memory_hits"] + stats["disk_hits"] + stats["misses"]
+    stats["hit_rate"] = (stats["memory_hits"] + stats["disk_hits"]) / lookups if lookups else 0.0
+    return stats
+
+
+def clear_embedding_cache():
+    """
+    Remove every entry of the in-memory tier (the on-disk tier is kept)
+    """
+    with _embedding_cache_lock:
+        _embedding_cache.clear()
+        _embedding_cache_stats["memory_bytes"] = 0
@@ -0,0 +1,126 @@
+"""
+This module contains the inference backends of the alignment encoder:
+fp32 (eager PyTorch), dynamic int8 quantization, bf16 and ONNX Runtime.
+"""
+
+import os
+import hashlib
+
+import torch
+
+
+# Supported encoder backends
+ENCODER_BACKENDS = ["fp32", "int8", "bf16", "onnx"]
+
+# Directory of the exported ONNX encoders
+ONNX_MODELS_DIR = os.environ.get("ONNX_MODELS_DIR", "onnx_models")
+
+
+class _LastHiddenState(torch.nn.Module):
+    """
+    Wrap an encoder so that its only output is the last hidden state
+    """
+
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, input_ids, attention_mask):
+        return self.model(input_ids, attention_mask=attention_mask)[0]
+
+
+class OnnxEncoder:
+    """
+    Run an exported encoder with ONNX Runtime, with the same call interface as a BertModel
+    """
+
+    def __init__(self, path, config, num_threads=None):
+        import onnxruntime
+
+        options = onnxruntime.SessionOptions()
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        self.session = onnxruntime.InferenceSession(
+            path, sess_options=options, providers=["CPUExecutionProvider"])
+        self.config = config
+        self.size_mb = os.path.getsize(path) / (1024 ** 2)
+
+    def __call__(self, input_ids, attention_mask=None, **kwargs):
+        if attention_mask is None:
+            attention_mask = torch.ones_like(input_ids)
+        hidden = self.session.run(["hidden_state"], {
+            "input_ids": input_ids.numpy(),
+            "attention_mask": attention_mask.long().numpy(),
+        })[0]
+        return (torch.from_numpy(hidden),)
+
+
+def get_model_revision(config):
+    """
+    Get the hub commit of a loaded checkpoint, or a hash of its configuration (e.g. for a local path)
+    """
+    revision = getattr(config, "_commit_hash", None)
+    if revision:
+        return revision[:12]
+    return hashlib.sha1(config.to_json_string().encode("utf-8")).hexdigest()[:12]
+
+
+def get_onnx_path(model_name, num_layers, revision=None):
+    """
+    Get the path of the exported ONNX encoder of a checkpoint (revision) truncated to `num_layers` layers
+    """
+    name = f"layer-{num_layers}.onnx" if revision is None else f"layer-{num_layers}-{revision}.onnx"
+    return os.path.join(ONNX_MODELS_DIR, model_name.replace("/", "--"), name)
+
+
+def export_onnx_encoder(model, path):
+    """
+    Export a (truncated) encoder to ONNX, so that the graph only computes and emits its last hidden state.\n
+    The graph is written to a temporary file first, so that concurrent workers never read a partial one
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+
+    input_ids = torch.ones((2, 8), dtype=torch.long)
+    attention_mask = torch.ones((2, 8), dtype=torch.long)
+
+    torch.onnx.export(
+        _LastHiddenState(model).eval(),
+        (input_ids, attention_mask),
+        tmp_path,
+        input_names=["input_ids", "attention_mask"],
+        output_names=["hidden_state"],
+        dynamic_axes={
+            "input_ids": {0: "batch", 1: "sequence"},
+            "attention_mask": {0: "batch", 1: "sequence"},
+            "hidden_state": {0: "batch", 1: "sequence"},
+        },
+        opset_version=14,
+        dynamo=False,
+    )
+    os.replace(tmp_path, path)
+
+
+def apply_encoder_backend(model, backend, model_name=None, num_layers=None):
+    """
+    Convert an fp32 encoder to the given backend
+    """
+    if backend == "fp32":
+        return model
+
+    elif backend == "int8":
+        # int8 weights, activations quantized on the fly, for every linear layer
+        return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+    elif backend == "bf16":
+        return model.to(torch.bfloat16)
+
+    elif backend == "onnx":
+        if num_layers is None:
+            raise ValueError("The ONNX backend needs an encoder truncated to the alignment layer")
+        path = get_onnx_path(model_name, num_layers, revision=get_model_revision(model.config))
+        if not os.path.exists(path):
+            export_onnx_encoder(model, path)
+        return OnnxEncoder(path, model.config, num_threads=torch.get_num_threads())
+
+    raise ValueError(f"Unknown encoder backend: {backend}")
@@ -0,0 +1,270 @@
+"""
+This module contains the instrumentation of the request stages: timing spans with
+per-stage latency histograms, counters, gauges, sampled profiling (cProfile or torch profiler)
+and the exporters of the metrics (JSON snapshot, Prometheus text and periodic log).
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import bisect
+import threading
+from contextlib import contextmanager
+
+
+# Set METRICS_ENABLED=0 to turn the spans and counters into no-ops
+METRICS_ENABLED = os.environ.get("METRICS_ENABLED", "1").lower() not in ("0", "false", "no")
+
+# Fraction of the profiled requests that are actually profiled (0 disables profiling)
+PROFILE_SAMPLE_RATE = float(os.environ.get("PROFILE_SAMPLE_RATE", 0))
+
+# Profiler of the sampled requests, "cprofile" or "torch"
+PROFILER = os.environ.get("PROFILER", "cprofile")
+
+# Directory of the profiles of the sampled requests
+PROFILE_DIR = os.environ.get("PROFILE_DIR", "profiles")
+
+# Upper bounds (in seconds) of the latency histogram buckets, the last bucket is unbounded
+latency_buckets = [
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+    0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0,
+]
+
+_metrics_lock = threading.Lock()
+_histograms = {}
+_counters = {}
+_gauges = {}
+
+# the profilers are process-wide, so at most one request is profiled at a time
+_profile_lock = threading.Lock()
+
+
+def _new_histogram():
+    return {"count": 0, "sum": 0.0, "max": 0.0, "buckets": [0] * (len(latency_buckets) + 1)}
+
+
+def observe(name, seconds):
+    """
+    Record a duration (in seconds) in the latency histogram of a stage
+    """
+    if not METRICS_ENABLED:
+        return
+    index = bisect.bisect_left(latency_buckets, seconds)
+    with _metrics_lock:
+        histogram = _histograms.get(name)
+        if histogram is None:
+            histogram = _histograms[name] = _new_histogram()
+        histogram["count"] += 1
+        histogram["sum"] += seconds
+        histogram["max"] = max(histogram["max"], seconds)
+        histogram["buckets"][index] += 1
+
+
+def increment(name, value=1):
+    """
+    Add `value` to a counter
+    """
+    if not METRICS_ENABLED:
+        return
+    with _metrics_lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+def set_gauge(name, value):
+    """
+    Set the current value of a gauge (e.g. a queue depth)
+    """
+    if not METRICS_ENABLED:
+        return
+    with _metrics_lock:
+        _gauges[name] = value
+
+
+@contextmanager
+def span(name):
+    """
+    Time the enclosed block as the stage `name` (also when it raises, which is counted in `name.errors`)
+    """
+    if not METRICS_ENABLED:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        increment(f"{name}.errors")
+        raise
+    finally:
+        observe(name, time.perf_counter() - start)
+
+
+def get_quantile(histogram, q):
+    """
+    Estimate a quantile of a latency histogram, interpolating linearly inside its bucket
+    """
+    if not histogram["count"]:
+        return 0.0
+    rank = q * histogram["count"]
+    seen = 0
+    for index, count in enumerate(histogram["buckets"]):
+        if count and seen + count >= rank:
+            lower = latency_buckets[index - 1] if index > 0 else 0.0
+            upper = latency_buckets[index] if index < len(latency_buckets) else histogram["max"]
+            return min(lower + (upper - lower) * (rank - seen) / count, histogram["max"])
+        seen += count
+    return histogram["max"]
+
+
+def get_metrics(reset=False):
+    """
+    Get a snapshot of the counters, the gauges and the latency histograms of every stage
+    (count, total/mean/max seconds, estimated p50/p95/p99 and bucket counts)
+    """
+    with _metrics_lock:
+        histograms = dict((name, dict(histogram, buckets=list(histogram["buckets"])))
+                          for name, histogram in _histograms.items())
+        counters = dict(_counters)
+        gauges = dict(_gauges)
+        if reset:
+            _histograms.clear()
+            _counters.clear()
+            _gauges.clear()
+
+    stages = {}
+    for name, histogram in sorted(histograms.items()):
+        stages[name] = {
+            "count": histogram["count"],
+            "sum": histogram["sum"],
+            "mean": histogram["sum"] / histogram["count"] if histogram["count"] else 0.0,
+            "max": histogram["max"],
+            "p50": get_quantile(histogram, 0.50),
+            "p95": get_quantile(histogram, 0.95),
+            "p99": get_quantile(histogram, 0.99),
+            "buckets": histogram["buckets"],
+        }
+
+    return {"stages": stages, "counters": dict(sorted(counters.items())), "gauges": dict(sorted(gauges.items()))}
+
+
+def merge_metrics(metrics):
+    """
+    Add a snapshot of `get_metrics` (e.g. taken in a worker process) to the metrics of this process
+    """
+    with _metrics_lock:
+        for name, stage in metrics["stages"].items():
+            histogram = _histograms.get(name)
+            if histogram is None:
+                histogram = _histograms[name] = _new_histogram()
+            histogram["count"] += stage["count"]
+            histogram["sum"] += stage["sum"]
+            histogram["max"] = max(histogram["max"], stage["max"])
+            histogram["buckets"] = [a + b for a, b in zip(histogram["buckets"], stage["buckets"])]
+        for name, value in metrics["counters"].items():
+            _counters[name] = _counters.get(name, 0) + value
+        # the gauges of the snapshot are more recent
+        _gauges.update(metrics.get("gauges", {}))
+
+
+def reset_metrics():
+    """
+    Clear every counter, gauge and histogram
+    """
+    get_metrics(reset=True)
+
+
+def _get_metric_name(name):
+    return "alignments_" + "".join(c if c.isalnum() else "_" for c in name)
+
+
+def render_prometheus(metrics=None):
+    """
+    Render the metrics in the Prometheus text exposition format
+    """
+    metrics = metrics or get_metrics()
+    lines = []
+
+    for name, value in metrics["counters"].items():
+        metric = _get_metric_name(name) + "_total"
+        lines += [f"# TYPE {metric} counter", f"{metric} {value}"]
+
+    for name, value in metrics.get("gauges", {}).items():
+        metric = _get_metric_name(name)
+        lines += [f"# TYPE {metric} gauge", f"{metric} {value}"]
+
+    for name, stage in metrics["stages"].items():
+        metric = _get_metric_name(name) + "_seconds"
+        lines.append(f"# TYPE {metric} histogram")
+        cumulative = 0
+        for bound, count in zip(latency_buckets + ["+Inf"], stage["buckets"]):
+            cumulative += count
+            lines.append(f'{metric}_bucket{{le="{bound}"}} {cumulative}')
+        lines += [f"{metric}_sum {stage['sum']}", f"{metric}_count {stage['count']}"]
+
+    return "\n".join(lines) + "\n"
+
+
+@contextmanager
+def profiled(name, sample_rate=None, profiler=None):
+    """
+    Profile the enclosed block for a sampled fraction (`PROFILE_SAMPLE_RATE`) of the calls,
+    with cProfile (a .prof file for pstats/snakeviz) or the torch profiler (a Chrome trace),
+    written to `PROFILE_DIR`.\n
+    cProfile only profiles the calling thread, so work handed to another thread must be profiled there
+    """
+    sample_rate = PROFILE_SAMPLE_RATE if sample_rate is None else sample_rate
+    profiler = profiler or PROFILER
+
+    if sample_rate <= 0 or random.random() >= sample_rate or not _profile_lock.acquire(blocking=False):
+        yield
+        return
+
+    try:
+        yield from _profile(name, profiler)
+    finally:
+        _profile_lock.release()
+
+
+def _profile(name, profiler):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    path = os.path.join(PROFILE_DIR, f"{name}-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{random.getrandbits(24):06x}")
+
+    if profiler == "torch":
+        import torch
+
+        with torch.profiler.profile(activities=[torch.profiler.ProfilerActivity.CPU], record_shapes=True) as prof:
+            yield
+        prof.export_chrome_trace(path + ".json")
+    else:
+        import cProfile
+
+        prof = cProfile.Profile()
+        prof.enable()
+        try:
+            yield
+        finally:
+            prof.disable()
+            prof.dump_stats(path + ".prof")
+
+    increment("profiles")
+
+
+def start_metrics_logger(interval, path=None):
+    """
+    Print to stderr (or append to the JSON lines file `path`) a snapshot of the metrics every `interval` seconds
+    from a daemon thread
+    """
+    def run():
+        while True:
+            time.sleep(interval)
+            line = json.dumps(dict(get_metrics(), time=time.time(), pid=os.getpid()))
+            if path:
+                with open(path, "a", encoding="utf-8") as f:
+                    f.write(line + "\n")
+            else:
+                print(line, file=sys.stderr, flush=True)
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    return thread
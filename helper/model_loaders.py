@@ -0,0 +1,194 @@
+"""
+This module contains a process-wide registry of the alignment models and tokenizers,
+so that the checkpoints are loaded once and reused across requests.
+"""
+
+import os
+import time
+import threading
+from collections import OrderedDict
+
+import torch
+
+from .encoder_backends import apply_encoder_backend
+from .resources import lazy_import, get_pretrained_kwargs
+from .metrics import observe
+
+
+# Maximum number of checkpoints kept in memory at the same time
+MAX_CACHED_MODELS = int(os.environ.get("MAX_CACHED_MODELS", 5))
+
+# Optional RAM budget (in MB) for the cached model weights, 0 means no budget
+MAX_CACHED_MODELS_MB = float(os.environ.get("MAX_CACHED_MODELS_MB", 0))
+
+_model_cache = OrderedDict()
+_model_cache_lock = threading.Lock()
+# one lock per checkpoint being loaded, so that a miss never blocks the hits of the other checkpoints
+_model_load_locks = {}
+_model_cache_stats = {
+    "hits": 0,
+    "misses": 0,
+    "evictions": 0,
+    "load_time": 0.0,
+}
+
+
+def get_model_size_mb(model):
+    """
+    Get the memory used by the weights of a model (in MB)
+    """
+    if not isinstance(model, torch.nn.Module):
+        return getattr(model, "size_mb", 0.0)
+
+    size = 0
+    # quantized layers keep their packed weights in tuples
+    for value in model.state_dict().values():
+        for tensor in (value if isinstance(value, (tuple, list)) else [value]):
+            if torch.is_tensor(tensor):
+                size += tensor.numel() * tensor.element_size()
+    return size / (1024 ** 2)
+
+
+def _get_cache_size_mb():
+    return sum(entry["size_mb"] for entry in _model_cache.values())
+
+
+def _evict_models(incoming_size_mb=0.0):
+    """
+    Evict the least recently used models until the count and RAM budgets are satisfied
+    """
+    while _model_cache and len(_model_cache) >= MAX_CACHED_MODELS:
+        _model_cache.popitem(last=False)
+        _model_cache_stats["evictions"] += 1
+
+    if MAX_CACHED_MODELS_MB > 0:
+        while _model_cache and _get_cache_size_mb() + incoming_size_mb > MAX_CACHED_MODELS_MB:
+            _model_cache.popitem(last=False)
+            _model_cache_stats["evictions"] += 1
+
+
+def get_cache_key(model_name, num_layers=None, backend="fp32"):
+    """
+    Get the registry key of a checkpoint, optionally truncated to its first `num_layers` layers
+    and converted to an encoder backend
+    """
+    key = model_name if num_layers is None else f"{model_name}@{num_layers}"
+    return key if backend == "fp32" else f"{key}:{backend}"
+
+
+def load_model_and_tokenizer(model_name, num_layers=None, backend="fp32"):
+    """
+    Get the model and tokenizer of a checkpoint from the registry,
+    loading it (and evicting the least recently used ones) on a miss.\n
+    If `num_layers` is given, only the embeddings and the first `num_layers`
+    encoder layers are loaded (no pooler), so the last hidden state of the model
+    is the `num_layers`-th hidden state of the full checkpoint.
+    `backend` is one of the encoder backends (fp32, int8, bf16, onnx)
+    """
+    key = get_cache_key(model_name, num_layers, backend)
+
+    with _model_cache_lock:
+        entry = _get_cached_entry(key)
+        if entry is not None:
+            return entry["model"], entry["tokenizer"]
+        load_lock = _model_load_locks.setdefault(key, threading.Lock())
+
+    with load_lock:
+        # the checkpoint may have been loaded by the thread this one waited for
+        with _model_cache_lock:
+            entry = _get_cached_entry(key)
+            if entry is not None:
+                return entry["model"], entry["tokenizer"]
+            _model_cache_stats["misses"] += 1
+
+        try:
+            return _load_model_and_tokenizer(key, model_name, num_layers, backend)
+        finally:
+            with _model_cache_lock:
+                _model_load_locks.pop(key, None)
+
+
+def _get_cached_entry(key):
+    if key not in _model_cache:
+        return None
+    _model_cache.move_to_end(key)
+    _model_cache_stats["hits"] += 1
+    return _model_cache[key]
+
+
+def _load_model_and_tokenizer(key, model_name, num_layers, backend):
+    """
+    Load a checkpoint (outside of the registry lock) and add it to the registry
+    """
+    transformers = lazy_import("transformers")
+    # Set the verbosity to error, so that the warning messages are not printed
+    transformers.logging.set_verbosity_error()
+
+    start = time.perf_counter()
+    if num_layers is None:
+        model = transformers.BertModel.from_pretrained(model_name, **get_pretrained_kwargs())
+    else:
+        model = transformers.BertModel.from_pretrained(
+            model_name, num_hidden_layers=num_layers, add_pooling_layer=False, **get_pretrained_kwargs())
+    tokenizer = transformers.BertTokenizerFast.from_pretrained(model_name, **get_pretrained_kwargs())
+    model.eval()
+    model = apply_encoder_backend(model, backend, model_name=model_name, num_layers=num_layers)
+    load_time = time.perf_counter() - start
+    observe("model.load", load_time)
+
+    size_mb = get_model_size_mb(model)
+
+    with _model_cache_lock:
+        _evict_models(incoming_size_mb=size_mb)
+        _model_cache[key] = {
+            "model": model,
+            "tokenizer": tokenizer,
+            "size_mb": size_mb,
+            "load_time": load_time,
+        }
+        _model_cache_stats["load_time"] += load_time
+
+    return model, tokenizer
+
+
+_num_hidden_layers = {}
+
+
+def get_num_hidden_layers(model_name):
+    """
+    Get the number of encoder layers of a checkpoint from its configuration (without loading its weights)
+    """
+    if model_name not in _num_hidden_layers:
+        transformers = lazy_import("transformers")
+        _num_hidden_layers[model_name] = transformers.AutoConfig.from_pretrained(
+            model_name, **get_pretrained_kwargs()).num_hidden_layers
+    return _num_hidden_layers[model_name]
+
+
+def warm_up_models(model_names, num_layers=None, backend="fp32"):
+    """
+    Eagerly load a list of checkpoints into the registry (e.g. at startup)
+    """
+    for model_name in model_names:
+        load_model_and_tokenizer(model_name, num_layers=num_layers, backend=backend)
+
+
+def get_model_cache_stats():
+    """
+    Get the hit/miss/eviction counters and load times of the registry
+    """
+    with _model_cache_lock:
+        stats = dict(_model_cache_stats)
+        stats["cached_models"] = list(_model_cache.keys())
+        stats["cached_size_mb"] = _get_cache_size_mb()
+        stats["model_load_times"] = dict(
+            (name, entry["load_time"]) for name, entry in _model_cache.items())
+    return stats
+
+
+def clear_model_cache():
+    """
+    Remove every checkpoint from the registry
+    """
+    with _model_cache_lock:
+        _model_cache.clear()
@@ -2,128 +2,156 @@
 This module contains the functions to get PoS tags using Spacy and return a Markdown table
 """
 
-from .alignment_mappers import get_alignment_mapping, select_model
+import threading
 
-from flair.models import SequenceTagger
-from flair.data import Sentence
+from .alignment_mappers import get_alignment_result, align_batch, select_model
+from .alignment_results import render_html, get_accuracy, is_punctuation_pair
+from .metrics import span, increment
 
-import spacy
-from spacy.cli import download
-download("en_core_web_sm")
-import en_core_web_sm
+# spaCy, NLTK, flair and TextBlob are imported on first use,
+# and their models/data are downloaded by `provision.py` (see helper/resources.py)
+from .resources import lazy_import, get_nltk, load_flair_tagger, load_spacy_model
 
-import nltk
-nltk.download('punkt')
-nltk.download('averaged_perceptron_tagger')
 
-from textblob import TextBlob
+_taggers = {}
+_taggers_lock = threading.Lock()
 
 
+def get_spacy_nlp():
+    ''' 
+    Get the cached spacy pipeline (only the components needed for tagging) 
+    '''
+    with _taggers_lock:
+        if "spaCy" not in _taggers:
+            _taggers["spaCy"] = load_spacy_model(disable=["parser", "ner", "lemmatizer"])
+        return _taggers["spaCy"]
+
+def get_flair_tagger():
+    ''' 
+    Get the cached flair pos tagger 
+    '''
+    with _taggers_lock:
+        if "Flair" not in _taggers:
+            _taggers["Flair"] = load_flair_tagger()
+        return _taggers["Flair"]
+
+def get_spacy_postag_dicts(targets, batch_size=64, n_process=1):
+    ''' 
+    Get spacy pos tags of many sentences 
+    '''
+    nlp = get_spacy_nlp()
+    return [dict((token.text, token.tag_) for token in target_tokenized)
+            for target_tokenized in nlp.pipe(targets, batch_size=batch_size, n_process=n_process)]
+
+def get_nltk_postag_dicts(targets):
+    ''' 
+    Get nltk pos tags of many sentences 
+    '''
+    nltk = get_nltk()
+    targets_tokenized = [nltk.tokenize.word_tokenize(target) for target in targets]
+    return [dict((key, value) for key, value in tagged)
+            for tagged in nltk.pos_tag_sents(targets_tokenized)]
+
+def get_flair_postag_dicts(targets, mini_batch_size=32):
+    ''' 
+    Get flair pos tags of many sentences 
+    '''
+    tagger = get_flair_tagger()
+    Sentence = lazy_import("flair.data").Sentence
+    targets_tokenized = [Sentence(target) for target in targets]
+    tagger.predict(targets_tokenized, mini_batch_size=mini_batch_size)
+    return [dict((token.text, token.tag) for token in target_tokenized)
+            for target_tokenized in targets_tokenized]
+
+def get_textblob_postag_dicts(targets):
+    ''' 
+    Get textblob pos tags of many sentences 
+    '''
+    get_nltk()
+    TextBlob = lazy_import("textblob").TextBlob
+    return [dict(TextBlob(target).tags) for target in targets]
+
+def get_spacy_postags(tokens_list, batch_size=64, n_process=1):
+    ''' 
+    Get spacy pos tags of many pre-tokenized sentences (one tag per token) 
+    '''
+    nlp = get_spacy_nlp()
+    Doc = lazy_import("spacy.tokens").Doc
+    docs = [Doc(nlp.vocab, words=tokens) for tokens in tokens_list]
+    return [[token.tag_ for token in doc]
+            for doc in nlp.pipe(docs, batch_size=batch_size, n_process=n_process)]
+
+def get_nltk_postags(tokens_list):
+    ''' 
+    Get nltk pos tags of many pre-tokenized sentences (one tag per token) 
+    '''
+    nltk = get_nltk()
+    return [[tag for _, tag in tagged] for tagged in nltk.pos_tag_sents(tokens_list)]
+
+def get_flair_postags(tokens_list, mini_batch_size=32):
+    ''' 
+    Get flair pos tags of many pre-tokenized sentences (one tag per token) 
+    '''
+    tagger = get_flair_tagger()
+    Sentence = lazy_import("flair.data").Sentence
+    # empty sentences are skipped by flair, they get no tags
+    sentences = [Sentence(tokens) for tokens in tokens_list]
+    tagger.predict([sentence for sentence in sentences if len(sentence)], mini_batch_size=mini_batch_size)
+    return [[token.tag for token in sentence] for sentence in sentences]
+
+def get_textblob_postags(tokens_list):
+    ''' 
+    Get textblob pos tags of many pre-tokenized sentences (one tag per token).
+    TextBlob tags with the NLTK averaged perceptron tagger after its own tokenization,
+    so the pre-tokenized sentences go straight to that tagger 
+    '''
+    return get_nltk_postags(tokens_list)
+
 def get_spacy_postag_dict(target=""):
     ''' 
     Get spacy pos tags 
     '''
-    nlp = en_core_web_sm.load()
-    target_tokenized = nlp(target)
-    spacy_postag_dict = dict((token.text, token.tag_)
-                             for token in target_tokenized)
-    return spacy_postag_dict
+    return get_spacy_postag_dicts([target])[0]
 
 def get_nltk_postag_dict(target=""):
     ''' 
     Get nltk pos tags 
     '''
-    target_tokenized = nltk.tokenize.word_tokenize(target)
-    nltk_postag_dict = dict((key, value)
-                            for key, value in nltk.pos_tag(target_tokenized))
-    return nltk_postag_dict
+    return get_nltk_postag_dicts([target])[0]
 
 def get_flair_postag_dict(target=""):
     ''' 
     Get flair pos tags 
     '''
-    tagger = SequenceTagger.load("pos")
-    target_tokenized = Sentence(target)
-    tagger.predict(target_tokenized)
-    flair_postag_dict = dict((token.text, token.tag)
-                             for token in target_tokenized)
-    return flair_postag_dict
+    return get_flair_postag_dicts([target])[0]
 
 def get_textblob_postag_dict(target=""):
     ''' 
     Get textblob pos tags 
     '''
-    blob = TextBlob(target)
-    textblob_postag_dict = dict(blob.tags)
-    return textblob_postag_dict
+    return get_textblob_postag_dicts([target])[0]
 
 def get_postag(
-        get_postag_dict,
+        get_postags,
         source="", 
         target="", 
         model_name="musfiqdehan/bn-en-word-aligner"):
     """Get Spacy PoS Tags and return a Markdown table"""
 
-    sent_src, sent_tgt, align_words = get_alignment_mapping(
+    result = get_alignment_result(
         source=source, target=target, model_name=model_name
     )
-    postag_dict = get_postag_dict(target=target)
-
-    mapped_sent_src = []
-
-    html_table = '''
-                    <table>
-                        <thead>
-                            <th>Bangla</th>
-                            <th>English</th>
-                            <th>PoS Tags</th>
-                        </thead>
-                '''
-
-    for i, j in sorted(align_words):
-        punc = r"""!()-[]{}।;:'"\,<>./?@#$%^&*_~"""
-        if sent_src[i] in punc or sent_tgt[j] in punc:
-            mapped_sent_src.append(sent_src[i])
-
-            html_table += f'''
-                            <tbody>
-                                <tr>
-                                    <td> {sent_src[i]} </td>
-                                    <td> {sent_tgt[j]} </td>
-                                    <td> PUNC </td>
-                                </tr>
-                            '''
-        else:
-            mapped_sent_src.append(sent_src[i])
-
-            html_table += f'''
-                            <tr>
-                                <td> {sent_src[i]} </td>
-                                <td> {sent_tgt[j]} </td>
-                                <td> {postag_dict[sent_tgt[j]]} </td>
-                            </tr>
-                            '''
-
-    unks = list(set(sent_src).difference(set(mapped_sent_src)))
-    for word in unks:
-
-        html_table += f'''
-                        <tr>
-                            <td> {word} </td>
-                            <td> N/A </td>
-                            <td> UNK </td>
-                        </tr>                         
-                    '''
-        
-    html_table += '''
-                        </tbody>
-                    </table>
-                '''
-    
-    pos_accuracy = ((len(sent_src) - len(unks)) / len(sent_src))
-    pos_accuracy = f"{pos_accuracy:0.2%}"
-
-    return html_table, pos_accuracy
+    # the tagger gets the tokens of the aligner, so the tags are indexed like sent_tgt
+    with span("pos_tag.tag"):
+        postags = get_postags([result.target_words])[0]
+
+    tags = [
+        "PUNC" if is_punctuation_pair(result.source_words[i], result.target_words[j]) else postags[j]
+        for i, j in result.pairs.tolist()]
+
+    html_table = render_html(result, headers=("Bangla", "English", "PoS Tags"), tags=tags)
+
+    return html_table, get_accuracy(result)
 
 
 def select_pos_tagger(src, tgt, model_name, tagger):
@@ -136,32 +164,81 @@ def select_pos_tagger(src, tgt, model_name, tagger):
 
     model_name = select_model(model_name)
 
+    increment(f"pos_tag.{tagger}.requests")
+
     if tagger == "spaCy":
         result, pos_accuracy = get_postag(
-            get_spacy_postag_dict,
+            get_spacy_postags,
             source=src,
             target=tgt,
             model_name=model_name, 
         )
     elif tagger == "NLTK":
         result, pos_accuracy = get_postag(
-            get_nltk_postag_dict,
+            get_nltk_postags,
             source=src,
             target=tgt,
             model_name=model_name, 
         )
     elif tagger == "Flair":
         result, pos_accuracy = get_postag(
-            get_flair_postag_dict,
+            get_flair_postags,
             source=src,
             target=tgt,
             model_name=model_name, 
         )
     elif tagger == "TextBlob":
         result, pos_accuracy = get_postag(
-            get_textblob_postag_dict,
+            get_textblob_postags,
             source=src,
             target=tgt,
             model_name=model_name, 
         )
     return result, pos_accuracy
+
+
+def select_postags(tagger):
+    ''' 
+    Select the function that gets the PoS tags of many pre-tokenized sentences with a tagger 
+    '''
+    postags_functions = {
+        "spaCy": get_spacy_postags,
+        "NLTK": get_nltk_postags,
+        "Flair": get_flair_postags,
+        "TextBlob": get_textblob_postags,
+    }
+    return postags_functions[tagger]
+
+
+def get_postag_alignments_batch(pairs, model_name="", tagger="spaCy", batch_size=32):
+    """
+    Get the aligned words and PoS tags of many (source, target) pairs,
+    aligning and tagging all the pairs in batches.\n
+    The target sentences are tokenized once and the same tokens are aligned and tagged,
+    so every aligned target word gets the tag of its own position
+    """
+    alignments = align_batch(pairs, model_name=model_name, batch_size=batch_size)
+    with span("pos_tag.tag"):
+        postags_list = select_postags(tagger)([sent_tgt for _, sent_tgt, _ in alignments])
+
+    results = []
+
+    for (sent_src, sent_tgt, align_words), postags in zip(alignments, postags_list):
+        result = []
+        for i, j in sorted(align_words):
+            if is_punctuation_pair(sent_src[i], sent_tgt[j]):
+                tag = "PUNC"
+            else:
+                tag = postags[j]
+            result.append((i, j, tag))
+        results.append((sent_src, sent_tgt, result))
+
+    return results
+
+
+def get_postag_alignments(source="", target="", model_name="", tagger="spaCy"):
+    """
+    Get the aligned words and the PoS tag of each aligned target word
+    as a list of (source index, target index, tag)
+    """
+    return get_postag_alignments_batch([(source, target)], model_name=model_name, tagger=tagger)[0]
@@ -0,0 +1,182 @@
+"""
+This module contains the helper functions to import the heavy libraries lazily (with timings),
+and to provision the downloadable resources (models, corpora) in a local cache directory.
+"""
+
+import os
+import time
+import socket
+import importlib
+
+
+# Local cache directory of the downloaded resources
+RESOURCES_DIR = os.environ.get(
+    "RESOURCES_DIR", os.path.join(os.path.expanduser("~"), ".cache", "multilingual-alignments"))
+
+NLTK_DATA_DIR = os.path.join(RESOURCES_DIR, "nltk_data")
+SPACY_MODEL_DIR = os.path.join(RESOURCES_DIR, "spacy", "en_core_web_sm")
+FLAIR_CACHE_DIR = os.path.join(RESOURCES_DIR, "flair")
+FLAIR_POS_MODEL = os.path.join(FLAIR_CACHE_DIR, "pos.pt")
+HF_CACHE_DIR = os.path.join(RESOURCES_DIR, "huggingface")
+
+# Let the app download a missing model on first use, instead of failing until `provision.py` is run
+RUNTIME_DOWNLOADS = os.environ.get("RUNTIME_DOWNLOADS", "0").lower() in ("1", "true", "yes")
+
+# NLTK data used by the NLTK and TextBlob taggers (old and new names), and their resource paths
+nltk_packages = {
+    "punkt": "tokenizers/punkt",
+    "punkt_tab": "tokenizers/punkt_tab",
+    "averaged_perceptron_tagger": "taggers/averaged_perceptron_tagger",
+    "averaged_perceptron_tagger_eng": "taggers/averaged_perceptron_tagger_eng",
+}
+
+_import_times = {}
+_startup_time = time.perf_counter()
+
+
+def lazy_import(module_name):
+    """
+    Import a module on first use and record how long the import took
+    """
+    start = time.perf_counter()
+    module = importlib.import_module(module_name)
+    if module_name not in _import_times:
+        _import_times[module_name] = time.perf_counter() - start
+    return module
+
+
+def get_startup_profile():
+    """
+    Get the import time (in seconds) of every lazily imported module, slowest first
+    """
+    profile = dict(sorted(_import_times.items(), key=lambda item: -item[1]))
+    return {
+        "imports": profile,
+        "total_import_time": sum(profile.values()),
+        "uptime": time.perf_counter() - _startup_time,
+    }
+
+
+def is_offline():
+    """
+    Check whether the resources cannot be downloaded (offline env flags or no network)
+    """
+    for flag in ("ALIGNMENT_OFFLINE", "HF_HUB_OFFLINE", "TRANSFORMERS_OFFLINE"):
+        if os.environ.get(flag, "0").lower() in ("1", "true", "yes"):
+            return True
+    try:
+        socket.create_connection(("huggingface.co", 443), timeout=2).close()
+        return False
+    except OSError:
+        return True
+
+
+def get_pretrained_kwargs(download=None):
+    """
+    Get the `from_pretrained` arguments of a Hugging Face checkpoint: it is looked up in the local cache
+    directory, and only downloaded there by the provisioning step (or with RUNTIME_DOWNLOADS)
+    """
+    download = RUNTIME_DOWNLOADS if download is None else download
+    return {"cache_dir": HF_CACHE_DIR, "local_files_only": not download}
+
+
+def get_nltk():
+    """
+    Import NLTK, looking up its data in the local cache directory first
+    """
+    nltk = lazy_import("nltk")
+    if NLTK_DATA_DIR not in nltk.data.path:
+        nltk.data.path.insert(0, NLTK_DATA_DIR)
+    return nltk
+
+
+def get_flair_models():
+    """
+    Import flair.models, caching the flair models in the local cache directory
+    """
+    os.environ.setdefault("FLAIR_CACHE_ROOT", FLAIR_CACHE_DIR)
+    return lazy_import("flair.models")
+
+
+def load_flair_tagger():
+    """
+    Load the flair PoS model saved in the local cache directory by the provisioning step
+    """
+    models = get_flair_models()
+    if os.path.exists(FLAIR_POS_MODEL):
+        return models.SequenceTagger.load(FLAIR_POS_MODEL)
+    if not RUNTIME_DOWNLOADS:
+        raise OSError(f"The flair PoS model is not in {FLAIR_CACHE_DIR}, run provision.py (or set RUNTIME_DOWNLOADS=1)")
+    return models.SequenceTagger.load("pos")
+
+
+def load_spacy_model(disable=()):
+    """
+    Load the English spaCy model from the local cache directory (or from the installed package)
+    """
+    spacy = lazy_import("spacy")
+    if os.path.exists(SPACY_MODEL_DIR):
+        return spacy.load(SPACY_MODEL_DIR, disable=list(disable))
+    return spacy.load("en_core_web_sm", disable=list(disable))
+
+
+def get_missing_resources(model_names=(), pos_taggers=True):
+    """
+    Get the resources used by the app that are not in the local cache directory yet
+    """
+    missing = []
+
+    transformers = lazy_import("transformers")
+    for model_name in model_names:
+        try:
+            transformers.AutoConfig.from_pretrained(model_name, **get_pretrained_kwargs(download=False))
+        except OSError:
+            missing.append(f"model:{model_name}")
+
+    if pos_taggers:
+        if not os.path.exists(SPACY_MODEL_DIR):
+            missing.append("spacy:en_core_web_sm")
+        if not os.path.exists(FLAIR_POS_MODEL):
+            missing.append("flair:pos")
+        nltk = get_nltk()
+        for package, resource in nltk_packages.items():
+            try:
+                nltk.data.find(resource)
+            except LookupError:
+                missing.append(f"nltk:{package}")
+
+    return missing
+
+
+def provision_resources(model_names=(), pos_taggers=True, offline=None):
+    """
+    Download the resources used by the app into the local cache directory:
+    the alignment models, the spaCy model, the NLTK data and the flair PoS model.\n
+    When offline (checked with `is_offline` unless given), nothing is downloaded
+    and the missing resources are returned
+    """
+    if offline is None:
+        offline = is_offline()
+
+    if offline:
+        return get_missing_resources(model_names, pos_taggers=pos_taggers)
+
+    transformers = lazy_import("transformers")
+    for model_name in model_names:
+        transformers.BertModel.from_pretrained(model_name, **get_pretrained_kwargs(download=True))
+        transformers.BertTokenizerFast.from_pretrained(model_name, **get_pretrained_kwargs(download=True))
+
+    if pos_taggers:
+        nltk = get_nltk()
+        for package in nltk_packages:
+            nltk.download(package, download_dir=NLTK_DATA_DIR, quiet=True)
+
+        if not os.path.exists(SPACY_MODEL_DIR):
+            lazy_import("spacy.cli").download("en_core_web_sm")
+            lazy_import("spacy").load("en_core_web_sm").to_disk(SPACY_MODEL_DIR)
+
+        if not os.path.exists(FLAIR_POS_MODEL):
+            os.makedirs(FLAIR_CACHE_DIR, exist_ok=True)
+            get_flair_models().SequenceTagger.load("pos").save(FLAIR_POS_MODEL)
+
+    return []
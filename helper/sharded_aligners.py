@@ -0,0 +1,79 @@
+"""
+This module contains the helper functions to align a corpus with a pool of worker processes.
+"""
+
+import os
+import itertools
+import multiprocessing
+from collections import deque
+
+import torch
+
+from .alignment_mappers import align_batch, select_model, select_align_layer, select_encoder_backend
+from .model_loaders import load_model_and_tokenizer
+from .corpus_readers import get_batches
+
+
+def _init_worker(model_name, num_layers, backend, threads_per_worker):
+    """
+    Pin the torch thread count of a worker and load its model once
+    """
+    torch.set_num_threads(threads_per_worker)
+    torch.set_num_interop_threads(1)
+    # with the fork start method the model preloaded by the parent is already in the registry
+    load_model_and_tokenizer(model_name, num_layers=num_layers, backend=backend)
+
+
+def _align_shard(model_name, pairs, batch_size):
+    return align_batch(pairs, model_name=model_name, batch_size=batch_size)
+
+
+def get_default_workers(threads_per_worker=1):
+    """
+    Get the number of workers that fills the CPU cores with `threads_per_worker` threads each
+    """
+    return max(1, (os.cpu_count() or 1) // threads_per_worker)
+
+
+def align_sharded(pairs, model_name="", num_workers=None, threads_per_worker=1, shard_size=256, batch_size=32, preload=True):
+    """
+    Align a stream of (source, target) sentence pairs with a pool of worker processes
+    and yield the results in the input order.\n
+    The corpus is cut into line-range shards of `shard_size` pairs, and at most
+    two shards per worker are in flight, so memory stays bounded for any corpus size.
+    With `preload`, the model is loaded by the parent and the workers are forked,
+    so they share its weights copy-on-write instead of loading their own copy
+    """
+    model_name = select_model(model_name)
+    num_layers = select_align_layer(model_name)
+    backend = select_encoder_backend(model_name)
+
+    if num_workers is None:
+        num_workers = get_default_workers(threads_per_worker)
+
+    start_methods = multiprocessing.get_all_start_methods()
+
+    if preload and "fork" in start_methods:
+        load_model_and_tokenizer(model_name, num_layers=num_layers, backend=backend)
+        context = multiprocessing.get_context("fork")
+    else:
+        context = multiprocessing.get_context("spawn")
+
+    with context.Pool(
+            processes=num_workers,
+            initializer=_init_worker,
+            initargs=(model_name, num_layers, backend, threads_per_worker)) as pool:
+
+        shards = get_batches(pairs, shard_size)
+        in_flight = deque()
+
+        for shard in itertools.islice(shards, 2 * num_workers):
+            in_flight.append(pool.apply_async(_align_shard, (model_name, shard, batch_size)))
+
+        while in_flight:
+            results = in_flight.popleft().get()
+
+            for shard in itertools.islice(shards, 1):
+                in_flight.append(pool.apply_async(_align_shard, (model_name, shard, batch_size)))
+
+            yield from results
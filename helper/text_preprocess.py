@@ -4,6 +4,162 @@ This file contains functions for text preprocessing
 
 import re
 
+from .metrics import span
+
+
+# Contractions of whole words (e.g. I'm -> I am, I've -> I have, etc.)
+# https://en.wikipedia.org/wiki/Wikipedia%3aList_of_English_contractions
+# https://stackoverflow.com/a/19794953
+contractions = {
+    "ain't": "am not",
+    "aren't": "are not",
+    "can't": "can not",
+    "can't've": "can not have",
+    "'cause": "because",
+    "could've": "could have",
+    "couldn't": "could not",
+    "couldn't've": "could not have",
+    "didn't": "did not",
+    "doesn't": "does not",
+    "don't": "do not",
+    "hadn't": "had not",
+    "hadn't've": "had not have",
+    "hasn't": "has not",
+    "haven't": "have not",
+    "he'd": "he would",
+    "he'd've": "he would have",
+    "he'll": "he will",
+    "he'll've": "he will have",
+    "he's": "he is",
+    "how'd": "how did",
+    "how'd'y": "how do you",
+    "how'll": "how will",
+    "how's": "how is",
+    "i'd": "i would",
+    "i'd've": "i would have",
+    "i'll": "i will",
+    "i'll've": "i will have",
+    "i'm": "i am",
+    "i've": "i have",
+    "isn't": "is not",
+    "it'd": "it would",
+    "it'd've": "it would have",
+    "it'll": "it will",
+    "it'll've": "it will have",
+    "it's": "it is",
+    "let's": "let us",
+    "ma'am": "madam",
+    "mayn't": "may not",
+    "might've": "might have",
+    "mightn't": "might not",
+    "mightn't've": "might not have",
+    "must've": "must have",
+    "mustn't": "must not",
+    "mustn't've": "must not have",
+    "needn't": "need not",
+    "needn't've": "need not have",
+    "o'clock": "of the clock",
+    "oughtn't": "ought not",
+    "oughtn't've": "ought not have",
+    "shan't": "shall not",
+    "sha'n't": "shall not",
+    "shan't've": "shall not have",
+    "she'd": "she would",
+    "she'd've": "she would have",
+    "she'll": "she will",
+    "she'll've": "she will have",
+    "she's": "she is",
+    "should've": "should have",
+    "shouldn't": "should not",
+    "shouldn't've": "should not have",
+    "so've": "so have",
+    "so's": "so as",
+    "that'd": "that would",
+    "that'd've": "that would have",
+    "that's": "that is",
+    "there'd": "there would",
+    "there'd've": "there would have",
+    "there's": "there is",
+    "they'd": "they would",
+    "they'd've": "they would have",
+    "they'll": "they will",
+    "they'll've": "they will have",
+    "they're": "they are",
+    "they've": "they have",
+    "to've": "to have",
+    "wasn't": "was not",
+    "we'd": "we would",
+    "we'd've": "we would have",
+    "we'll": "we will",
+    "we'll've": "we will have",
+    "we're": "we are",
+    "we've": "we have",
+    "weren't": "were not",
+    "what'll": "what will",
+    "what'll've": "what will have",
+    "what're": "what are",
+    "what's": "what is",
+    "what've": "what have",
+    "when's": "when is",
+    "when've": "when have",
+    "where'd": "where did",
+    "where's": "where is",
+    "where've": "where have",
+    "who'll": "who will",
+    "who'll've": "who will have",
+    "who's": "who is",
+    "who've": "who have",
+    "why's": "why is",
+    "why've": "why have",
+    "will've": "will have",
+    "won't": "will not",
+    "won't've": "will not have",
+    "would've": "would have",
+    "wouldn't": "would not",
+    "wouldn't've": "would not have",
+    "y'all": "you all",
+    "y'all'd": "you all would",
+    "y'all'd've": "you all would have",
+    "y'all're": "you all are",
+    "y'all've": "you all have",
+    "you'd": "you would",
+    "you'd've": "you would have",
+    "you'll": "you will",
+    "you'll've": "you will have",
+    "you're": "you are",
+    "you've": "you have"
+}
+
+# Contraction suffixes left after the whole word lookup, in replacement order
+contraction_suffixes = {
+    "'ve": " have",
+    "n't": " not",
+    "'re": " are",
+    "'ll": " will",
+    "'d": " would",
+    "'s": " is",
+    "'m": " am",
+}
+
+# Bengali to English digits
+digit_converter = {
+    '০': '0',
+    '১': '1',
+    '২': '2',
+    '৩': '3',
+    '৪': '4',
+    '৫': '5',
+    '৬': '6',
+    '৭': '7',
+    '৮': '8',
+    '৯': '9'
+}
+
+digit_table = str.maketrans(digit_converter)
+
+punc_pattern = re.compile('([.,:;\-।!?"()\'])')
+spaces_pattern = re.compile("\s{2,}")
+
 
 def decontracting_words(sentence):
     """
@@ -11,142 +167,12 @@ def decontracting_words(sentence):
     https://en.wikipedia.org/wiki/Wikipedia%3aList_of_English_contractions
     https://stackoverflow.com/a/19794953
     """
-    contractions = {
-        "ain't": "am not",
-        "aren't": "are not",
-        "can't": "can not",
-        "can't've": "can not have",
-        "'cause": "because",
-        "could've": "could have",
-        "couldn't": "could not",
-        "couldn't've": "could not have",
-        "didn't": "did not",
-        "doesn't": "does not",
-        "don't": "do not",
-        "hadn't": "had not",
-        "hadn't've": "had not have",
-        "hasn't": "has not",
-        "haven't": "have not",
-        "he'd": "he would",
-        "he'd've": "he would have",
-        "he'll": "he will",
-        "he'll've": "he will have",
-        "he's": "he is",
-        "how'd": "how did",
-        "how'd'y": "how do you",
-        "how'll": "how will",
-        "how's": "how is",
-        "i'd": "i would",
-        "i'd've": "i would have",
-        "i'll": "i will",
-        "i'll've": "i will have",
-        "i'm": "i am",
-        "i've": "i have",
-        "isn't": "is not",
-        "it'd": "it would",
-        "it'd've": "it would have",
-        "it'll": "it will",
-        "it'll've": "it will have",
-        "it's": "it is",
-        "let's": "let us",
-        "ma'am": "madam",
-        "mayn't": "may not",
-        "might've": "might have",
-        "mightn't": "might not",
-        "mightn't've": "might not have",
-        "must've": "must have",
-        "mustn't": "must not",
-        "mustn't've": "must not have",
-        "needn't": "need not",
-        "needn't've": "need not have",
-        "o'clock": "of the clock",
-        "oughtn't": "ought not",
-        "oughtn't've": "ought not have",
-        "shan't": "shall not",
-        "sha'n't": "shall not",
-        "shan't've": "shall not have",
-        "she'd": "she would",
-        "she'd've": "she would have",
-        "she'll": "she will",
-        "she'll've": "she will have",
-        "she's": "she is",
-        "should've": "should have",
-        "shouldn't": "should not",
-        "shouldn't've": "should not have",
-        "so've": "so have",
-        "so's": "so as",
-        "that'd": "that would",
-        "that'd've": "that would have",
-        "that's": "that is",
-        "there'd": "there would",
-        "there'd've": "there would have",
-        "there's": "there is",
-        "they'd": "they would",
-        "they'd've": "they would have",
-        "they'll": "they will",
-        "they'll've": "they will have",
-        "they're": "they are",
-        "they've": "they have",
-        "to've": "to have",
-        "wasn't": "was not",
-        "we'd": "we would",
-        "we'd've": "we would have",
-        "we'll": "we will",
-        "we'll've": "we will have",
-        "we're": "we are",
-        "we've": "we have",
-        "weren't": "were not",
-        "what'll": "what will",
-        "what'll've": "what will have",
-        "what're": "what are",
-        "what's": "what is",
-        "what've": "what have",
-        "when's": "when is",
-        "when've": "when have",
-        "where'd": "where did",
-        "where's": "where is",
-        "where've": "where have",
-        "who'll": "who will",
-        "who'll've": "who will have",
-        "who's": "who is",
-        "who've": "who have",
-        "why's": "why is",
-        "why've": "why have",
-        "will've": "will have",
-        "won't": "will not",
-        "won't've": "will not have",
-        "would've": "would have",
-        "wouldn't": "would not",
-        "wouldn't've": "would not have",
-        "y'all": "you all",
-        "y'all'd": "you all would",
-        "y'all'd've": "you all would have",
-        "y'all're": "you all are",
-        "y'all've": "you all have",
-        "you'd": "you would",
-        "you'd've": "you would have",
-        "you'll": "you will",
-        "you'll've": "you will have",
-        "you're": "you are",
-        "you've": "you have"
-    }
-
-    sentence_decontracted = []
-
-    for word in sentence.split():
-        if word in contractions:
-            word = contractions[word]
-
-        sentence_decontracted.append(word)
-
-    sentence = ' '.join(sentence_decontracted)
-    sentence = sentence.replace("'ve", " have")
-    sentence = sentence.replace("n't", " not")
-    sentence = sentence.replace("'re", " are")
-    sentence = sentence.replace("'ll", " will")
-    sentence = sentence.replace("'d", " would")
-    sentence = sentence.replace("'s", " is")
-    sentence = sentence.replace("'m", " am")
+    sentence = ' '.join([contractions.get(word, word) for word in sentence.split()])
+
+    # every suffix has an apostrophe, and str.replace beats a regex alternation here
+    if "'" in sentence:
+        for suffix, replacement in contraction_suffixes.items():
+            sentence = sentence.replace(suffix, replacement)
 
     return sentence
 
@@ -160,6 +186,31 @@ def space_punc(line):
     >> bla . bla ? " bla " bla . bla ! bla . . .
     """
 
-    line = re.sub('([.,:;\-।!?"()\'])', r" \1 ", line)
-    line = re.sub("\s{2,}", " ", line)
-    return line
\ No newline at end of file
+    line = punc_pattern.sub(r" \1 ", line)
+    line = spaces_pattern.sub(" ", line)
+    return line
+
+
+def translate_digits(sentence):
+    """
+    Translate the digits from Bengali to English
+    """
+    return sentence.translate(digit_table)
+
+
+def normalize_many(sentences, digits=True, decontract=False, punctuation=True):
+    """
+    Normalize many sentences with the precompiled tables:
+    translate the Bengali digits, decontract the words and space the punctuation marks
+    """
+    normalized = []
+    with span("preprocess.normalize_many"):
+        for sentence in sentences:
+            if digits:
+                sentence = sentence.translate(digit_table)
+            if decontract:
+                sentence = decontracting_words(sentence)
+            if punctuation:
+                sentence = spaces_pattern.sub(" ", punc_pattern.sub(r" \1 ", sentence))
+            normalized.append(sentence)
+    return normalized
\ No newline at end of file
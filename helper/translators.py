@@ -1,40 +1,138 @@
 """
 This file contains the functions to translate the text from one language to another.
 """
-from transformers import AutoModelForSeq2SeqLM, AutoTokenizer
-from deep_translator import GoogleTranslator, MyMemoryTranslator, MicrosoftTranslator, YandexTranslator, ChatGptTranslator
-from .text_preprocess import decontracting_words, space_punc
-
-
-# Digit Translation
-digit_converter = {
-    '০': '0',
-    '১': '1',
-    '২': '2',
-    '৩': '3',
-    '৪': '4',
-    '৫': '5',
-    '৬': '6',
-    '৭': '7',
-    '৮': '8',
-    '৯': '9'
-}
+import os
+import time
+import sqlite3
+import threading
+
+from .text_preprocess import decontracting_words, space_punc, translate_digits, digit_converter
+
+# torch, transformers and deep_translator are imported on first use
+from .resources import lazy_import
+from .metrics import span, increment
 
 
 def get_translated_digit(sentence):
     """
     Translate the digits from Bengali to English
     """
-    translated_sentence = []
-    for each_letter in sentence:
-        if each_letter in digit_converter.keys():
-            translated_sentence.append(digit_converter[each_letter])
-            # print(digit_converter[each_letter], end="")
-        else:
-            translated_sentence.append(each_letter)
-            # print(each_letter, end="")
+    return translate_digits(sentence)
+
+# Translation cache settings
+TRANSLATION_CACHE_PATH = os.environ.get("TRANSLATION_CACHE_PATH", "translation_cache.sqlite")
+TRANSLATION_CACHE_TTL = float(os.environ.get("TRANSLATION_CACHE_TTL", 7 * 24 * 60 * 60))
+TRANSLATION_CACHE_MAX_ENTRIES = int(os.environ.get("TRANSLATION_CACHE_MAX_ENTRIES", 100000))
+
+_translation_cache = None
+_translation_cache_lock = threading.Lock()
+_translation_cache_stats = {
+    "hits": 0,
+    "misses": 0,
+}
+
+
+def _get_translation_cache():
+    """
+    Open (once) the SQLite translation cache
+    """
+    global _translation_cache
+    if _translation_cache is None:
+        _translation_cache = sqlite3.connect(TRANSLATION_CACHE_PATH, check_same_thread=False)
+        _translation_cache.execute(
+            "CREATE TABLE IF NOT EXISTS translations ("
+            "source TEXT, tgt_lang_code TEXT, provider TEXT, translation TEXT, created_at REAL, "
+            "PRIMARY KEY (source, tgt_lang_code, provider))")
+        _translation_cache.execute(
+            "CREATE INDEX IF NOT EXISTS translations_created_at ON translations (created_at)")
+        _translation_cache.commit()
+    return _translation_cache
+
+
+def normalize_sentence(sentence):
+    """
+    Normalize the whitespace of a sentence, so that it can be used as a cache key
+    """
+    return " ".join(sentence.split())
+
+
+def get_cached_translation(sentence, tgt_lang_code, provider):
+    """
+    Get the cached translation of a sentence by a provider, or None (counted as a miss)
+    """
+    key = (normalize_sentence(sentence), tgt_lang_code, provider)
+
+    with _translation_cache_lock:
+        cache = _get_translation_cache()
+        row = cache.execute(
+            "SELECT translation, created_at FROM translations "
+            "WHERE source = ? AND tgt_lang_code = ? AND provider = ?", key).fetchone()
+
+        if row is not None and time.time() - row[1] < TRANSLATION_CACHE_TTL:
+            _translation_cache_stats["hits"] += 1
+            increment("translation_cache.hits")
+            return row[0]
+
+        _translation_cache_stats["misses"] += 1
+        increment("translation_cache.misses")
+
+    return None
+
+
+def translate_and_cache(sentence, tgt_lang_code, provider, translate):
+    """
+    Translate a (whitespace normalized) sentence with `translate(sentence, tgt_lang_code)`
+    and cache the result
+    """
+    source = normalize_sentence(sentence)
+
+    with span(f"translate.{provider.split(':')[0]}.request"):
+        translated = translate(source, tgt_lang_code)
+
+    with _translation_cache_lock:
+        cache = _get_translation_cache()
+        cache.execute(
+            "INSERT OR REPLACE INTO translations VALUES (?, ?, ?, ?, ?)",
+            (source, tgt_lang_code, provider, translated, time.time()))
+        # evict the expired entries, then the oldest ones above the size bound
+        cache.execute(
+            "DELETE FROM translations WHERE created_at < ?",
+            (time.time() - TRANSLATION_CACHE_TTL,))
+        cache.execute(
+            "DELETE FROM translations WHERE rowid IN ("
+            "SELECT rowid FROM translations ORDER BY created_at DESC LIMIT -1 OFFSET ?)",
+            (TRANSLATION_CACHE_MAX_ENTRIES,))
+        cache.commit()
+
+    return translated
+
+
+def cached_translation(sentence, tgt_lang_code, provider, translate):
+    """
+    Get the translation of a sentence from the cache,
+    or translate it with `translate(sentence, tgt_lang_code)` and cache the result
+    """
+    translated = get_cached_translation(sentence, tgt_lang_code, provider)
+    if translated is None:
+        translated = translate_and_cache(sentence, tgt_lang_code, provider, translate)
+    return translated
+
+
+def get_translation_cache_stats():
+    """
+    Get the hit/miss counters and the number of entries of the translation cache
+    """
+    with _translation_cache_lock:
+        stats = dict(_translation_cache_stats)
+        stats["entries"] = _get_translation_cache().execute(
+            "SELECT COUNT(*) FROM translations").fetchone()[0]
+    return stats
+
+
+def _google_translate(sentence, tgt_lang_code):
+    GoogleTranslator = lazy_import("deep_translator").GoogleTranslator
+    return GoogleTranslator(source='auto', target=tgt_lang_code).translate(sentence)
 
-    return "".join(each for each in translated_sentence)
 
 def google_translation(sentence, tgt_lang_code):
     """
@@ -42,18 +140,142 @@ def google_translation(sentence, tgt_lang_code):
     At first install dependencies \n
     `!pip install -U deep-translator`
     """
-    translated = GoogleTranslator(source='auto', target=tgt_lang_code).translate(sentence)
+    translated = cached_translation(sentence, tgt_lang_code, "google", _google_translate)
     return translated
 
 
-def get_better_translation(src, tgt_lang_code):
-    src_mod = get_translated_digit(src)
-    tgt = google_translation(src_mod, tgt_lang_code)
+# Local seq2seq translation settings (e.g. a Marian or NLLB checkpoint directory)
+LOCAL_MT_MODEL_PATH = os.environ.get("LOCAL_MT_MODEL_PATH", "")
+
+# Translation provider used by get_translations, "google" or "local"
+TRANSLATION_PROVIDER = os.environ.get("TRANSLATION_PROVIDER", "google")
+
+# Target language tokens of multilingual (NLLB style) checkpoints
+local_mt_lang_codes = {
+    "en": "eng_Latn",
+    "bn": "ben_Beng",
+    "hi": "hin_Deva",
+    "pa": "pan_Guru",
+    "ur": "urd_Arab",
+    "ar": "arb_Arab",
+    "zh": "zho_Hans",
+    "fr": "fra_Latn",
+    "de": "deu_Latn",
+    "es": "spa_Latn",
+}
+
+_local_mt_models = {}
+_local_mt_models_lock = threading.Lock()
+
+
+def load_local_mt_model(model_path):
+    """
+    Load (once) a local seq2seq translation model and its tokenizer
+    """
+    with _local_mt_models_lock:
+        if model_path not in _local_mt_models:
+            transformers = lazy_import("transformers")
+            tokenizer = transformers.AutoTokenizer.from_pretrained(model_path, local_files_only=True)
+            model = transformers.AutoModelForSeq2SeqLM.from_pretrained(model_path, local_files_only=True)
+            model.eval()
+            _local_mt_models[model_path] = (model, tokenizer)
+        return _local_mt_models[model_path]
+
+
+def local_translation_many(sentences, tgt_lang_code, model_path=None, batch_size=16, num_beams=1, max_new_tokens=256):
+    """
+    Translate many sentences with a local seq2seq model,
+    decoding length-bucketed batches with greedy (num_beams=1) or beam search
+    """
+    torch = lazy_import("torch")
+
+    model, tokenizer = load_local_mt_model(model_path or LOCAL_MT_MODEL_PATH)
+
+    generate_kwargs = {"num_beams": num_beams, "max_new_tokens": max_new_tokens}
+
+    # multilingual checkpoints need the target language as the first generated token
+    lang_token = local_mt_lang_codes.get(tgt_lang_code, tgt_lang_code)
+    lang_token_id = tokenizer.convert_tokens_to_ids(lang_token)
+    if lang_token_id is not None and lang_token_id != tokenizer.unk_token_id:
+        generate_kwargs["forced_bos_token_id"] = lang_token_id
+
+    # the sentences are tokenized once, and padded bucket by bucket
+    encodings = tokenizer(list(sentences), truncation=True)
+    order = sorted(range(len(sentences)), key=lambda k: len(encodings["input_ids"][k]))
+
+    translated = [None] * len(sentences)
+
+    for start in range(0, len(order), batch_size):
+        bucket = order[start:start + batch_size]
+
+        inputs = tokenizer.pad(
+            {"input_ids": [encodings["input_ids"][k] for k in bucket],
+             "attention_mask": [encodings["attention_mask"][k] for k in bucket]},
+            return_tensors="pt")
+
+        with torch.no_grad(), span("translate.local.generate"):
+            outputs = model.generate(
+                input_ids=inputs["input_ids"], attention_mask=inputs["attention_mask"], **generate_kwargs)
+
+        for k, text in zip(bucket, tokenizer.batch_decode(outputs, skip_special_tokens=True)):
+            translated[k] = text
+
+    return translated
+
+
+def local_translation(sentence, tgt_lang_code, model_path=None):
+    """
+    Translate a sentence with a local seq2seq model (no network access)
+    """
+    model_path = model_path or LOCAL_MT_MODEL_PATH
+    translated = cached_translation(
+        sentence, tgt_lang_code, f"local:{model_path}",
+        lambda text, code: local_translation_many([text], code, model_path=model_path)[0])
+    return translated
+
+
+def translation(sentence, tgt_lang_code, provider=None):
+    """
+    Translate a sentence with the selected provider ("google" or "local")
+    """
+    provider = provider or TRANSLATION_PROVIDER
+
+    if provider == "google":
+        with span("translate.google"):
+            return google_translation(sentence, tgt_lang_code)
+    elif provider == "local":
+        with span("translate.local"):
+            return local_translation(sentence, tgt_lang_code)
+
+    raise ValueError(f"Unknown translation provider: {provider}")
+
+
+def postprocess_translation(tgt):
+    """
+    Decontract the words of a translation and fix the currency names
+    """
     tgt = decontracting_words(tgt)
     tgt = tgt.replace('rupees', 'takas').replace('Rs', 'takas')
     return tgt
 
 
+def get_translations(src, tgt_lang_code, provider=None):
+    """
+    Get the plain translation of a sentence and its post-processed version (used for alignment)
+    with a single translation call
+    """
+    src_mod = get_translated_digit(src)
+    tgt_base = translation(src_mod, tgt_lang_code, provider=provider)
+    with span("translate.postprocess"):
+        tgt = postprocess_translation(tgt_base)
+    return tgt_base, tgt
+
+
+def get_better_translation(src, tgt_lang_code, provider=None):
+    _, tgt = get_translations(src, tgt_lang_code, provider=provider)
+    return tgt
+
+
 target_lang_dict = {
     "Afrikaans": "af",
     "Albanian": "sq",
@@ -0,0 +1,179 @@
+"""
+This module contains a pure NumPy inverted file (IVF) index for the inner product search of
+normalized sentence embeddings, stored on disk as .npy files that are memory-mapped on load.
+"""
+
+import os
+import json
+
+import numpy as np
+
+
+def train_centroids(sample, num_lists, iterations=10, seed=0):
+    """
+    Spherical k-means: `num_lists` unit centroids of a sample of unit vectors
+    """
+    sample = np.asarray(sample, dtype=np.float32)
+    rng = np.random.default_rng(seed)
+    centroids = sample[rng.choice(len(sample), size=num_lists, replace=False)].copy()
+
+    for _ in range(iterations):
+        assignments = (sample @ centroids.T).argmax(axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, sample)
+        counts = np.bincount(assignments, minlength=num_lists)
+
+        # empty lists restart from a random vector of the sample
+        empty = counts == 0
+        sums[empty] = sample[rng.choice(len(sample), size=int(empty.sum()))]
+
+        centroids = sums / np.linalg.norm(sums, axis=1, keepdims=True).clip(min=1e-12)
+
+    return centroids
+
+
+def get_default_num_lists(num_vectors):
+    """
+    About 4 * sqrt(n) lists, with at least 39 training vectors per list
+    """
+    return max(1, min(int(4 * np.sqrt(num_vectors)), num_vectors // 39))
+
+
+class IVFIndex:
+    """
+    Vectors grouped by their nearest centroid: `vectors[offsets[l]:offsets[l + 1]]` is the list `l`,
+    and `ids` holds the row of each stored vector in the indexed collection
+    """
+
+    def __init__(self, centroids, vectors, ids, offsets):
+        self.centroids = centroids
+        self.vectors = vectors
+        self.ids = ids
+        self.offsets = offsets
+
+    @property
+    def num_lists(self):
+        return len(self.centroids)
+
+    def __len__(self):
+        return len(self.ids)
+
+    @classmethod
+    def build(cls, vectors, num_lists=None, path=None, train_size=100000, chunk_size=65536, dtype=np.float16, seed=0):
+        """
+        Build an index of unit vectors (an array or a memory-mapped .npy file), training the
+        centroids on a sample of at most `train_size` vectors and assigning the vectors chunk by chunk.\n
+        With `path`, the grouped vectors are written to that directory instead of memory.
+        An empty collection gives an index without lists, whose searches find nothing
+        """
+        num_vectors = len(vectors)
+
+        rng = np.random.default_rng(seed)
+        sample = np.sort(rng.choice(num_vectors, size=min(train_size, num_vectors), replace=False))
+        # every list starts from a distinct training vector
+        num_lists = min(num_lists or get_default_num_lists(num_vectors), len(sample))
+        if num_lists:
+            centroids = train_centroids(vectors[sample], num_lists, seed=seed)
+        else:
+            centroids = np.zeros((0, vectors.shape[1]), dtype=np.float32)
+
+        assignments = np.empty(num_vectors, dtype=np.int32)
+        for start in range(0, num_vectors, chunk_size):
+            chunk = np.asarray(vectors[start:start + chunk_size], dtype=np.float32)
+            assignments[start:start + len(chunk)] = (chunk @ centroids.T).argmax(axis=1)
+
+        ids = np.argsort(assignments, kind="stable").astype(np.int64)
+        offsets = np.zeros(num_lists + 1, dtype=np.int64)
+        np.cumsum(np.bincount(assignments, minlength=num_lists), out=offsets[1:])
+
+        shape = (num_vectors, vectors.shape[1])
+        if path is None:
+            grouped = np.empty(shape, dtype=dtype)
+        else:
+            os.makedirs(path, exist_ok=True)
+            grouped = np.lib.format.open_memmap(
+                os.path.join(path, "vectors.npy"), mode="w+", dtype=dtype, shape=shape)
+
+        for start in range(0, num_vectors, chunk_size):
+            rows = ids[start:start + chunk_size]
+            # read the rows of the chunk in file order
+            order = np.argsort(rows)
+            chunk = np.empty((len(rows), shape[1]), dtype=dtype)
+            chunk[order] = vectors[rows[order]]
+            grouped[start:start + len(rows)] = chunk
+
+        index = cls(centroids.astype(np.float32), grouped, ids, offsets)
+        if path is not None:
+            grouped.flush()
+            index.save(path, vectors=False)
+        return index
+
+    def save(self, path, vectors=True):
+        """
+        Save the index as .npy files in a directory
+        """
+        os.makedirs(path, exist_ok=True)
+        np.save(os.path.join(path, "centroids.npy"), self.centroids)
+        np.save(os.path.join(path, "ids.npy"), self.ids)
+        np.save(os.path.join(path, "offsets.npy"), self.offsets)
+        if vectors:
+            np.save(os.path.join(path, "vectors.npy"), self.vectors)
+        with open(os.path.join(path, "index.json"), "w", encoding="utf-8") as f:
+            json.dump({"type": "ivf", "num_vectors": len(self.ids), "num_lists": self.num_lists,
+                       "dim": int(self.centroids.shape[1])}, f)
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        """
+        Load an index saved with `save`, memory-mapping its vectors and ids
+        """
+        mmap_mode = "r" if mmap else None
+        return cls(
+            np.load(os.path.join(path, "centroids.npy")),
+            np.load(os.path.join(path, "vectors.npy"), mmap_mode=mmap_mode),
+            np.load(os.path.join(path, "ids.npy"), mmap_mode=mmap_mode),
+            np.load(os.path.join(path, "offsets.npy")))
+
+    def search(self, queries, k=4, nprobe=8):
+        """
+        Get the (scores, ids) of the `k` largest inner products of every query,
+        looking only in the `nprobe` lists of the closest centroids (nprobe >= num_lists is exact).
+        Missing neighbours get the score -inf and the id -1
+        """
+        queries = np.asarray(queries, dtype=np.float32)
+        nprobe = min(nprobe, self.num_lists)
+
+        centroid_scores = queries @ self.centroids.T
+        if nprobe < self.num_lists:
+            probes = np.argpartition(-centroid_scores, nprobe - 1, axis=1)[:, :nprobe]
+        else:
+            probes = np.broadcast_to(np.arange(self.num_lists), (len(queries), self.num_lists))
+
+        scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        ids = np.full((len(queries), k), -1, dtype=np.int64)
+
+        # every probed list is scanned once for all the queries that probe it
+        query_rows = np.repeat(np.arange(len(queries)), probes.shape[1])
+        probe_lists = probes.ravel()
+        order = np.argsort(probe_lists, kind="stable")
+        query_rows, probe_lists = query_rows[order], probe_lists[order]
+        bounds = np.searchsorted(probe_lists, np.arange(self.num_lists + 1))
+
+        for list_id in range(self.num_lists):
+            rows = query_rows[bounds[list_id]:bounds[list_id + 1]]
+            start, end = self.offsets[list_id], self.offsets[list_id + 1]
+            if len(rows) == 0 or start == end:
+                continue
+
+            list_scores = queries[rows] @ np.asarray(self.vectors[start:end], dtype=np.float32).T
+            list_ids = np.broadcast_to(np.asarray(self.ids[start:end]), list_scores.shape)
+
+            merged_scores = np.concatenate([scores[rows], list_scores], axis=1)
+            merged_ids = np.concatenate([ids[rows], list_ids], axis=1)
+            top = np.argpartition(-merged_scores, k - 1, axis=1)[:, :k]
+            scores[rows] = np.take_along_axis(merged_scores, top, axis=1)
+            ids[rows] = np.take_along_axis(merged_ids, top, axis=1)
+
+        # sort the neighbours of every query by decreasing score
+        order = np.argsort(-scores, axis=1)
+        return np.take_along_axis(scores, order, axis=1), np.take_along_axis(ids, order, axis=1)
@@ -0,0 +1,66 @@
+"""
+Mine the parallel sentence pairs of two (non-aligned) corpora from the command line,
+with LaBSE sentence embeddings, IVF indexes and margin scoring, and stream them to a TSV file
+(score, source line, target line, source sentence, target sentence).
+
+The embeddings and indexes of each corpus are kept in --work-dir and reused by the next runs
+on the same files and model (they are rebuilt when a file or the model changes).
+
+Examples:
+    python mine_corpus.py --src news.bn --tgt news.en --work-dir mining --output mined.tsv
+    python mine_corpus.py --src news.bn --tgt news.en --work-dir mining --output mined.tsv --nprobe 16 --threshold 1.1
+"""
+
+import os
+import argparse
+
+from helper.bitext_miners import build_corpus_index, mine_bitext
+from helper.corpus_readers import read_lines, get_line_offsets, read_line
+
+
+def get_args():
+    parser = argparse.ArgumentParser(
+        description="Mine parallel sentence pairs with LaBSE embeddings and margin scoring")
+    parser.add_argument("--src", required=True, help="Source sentences, one per line")
+    parser.add_argument("--tgt", required=True, help="Target sentences, one per line")
+    parser.add_argument("--output", required=True, help="Output TSV file of the mined pairs")
+    parser.add_argument("--work-dir", required=True,
+                        help="Directory of the embeddings and indexes (reused when present)")
+    parser.add_argument("--model", default="SentenceTransformers-LaBSE (Multilingual)",
+                        help="Model display name or checkpoint")
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--k", type=int, default=4, help="Neighbours of the margin score")
+    parser.add_argument("--threshold", type=float, default=1.06, help="Minimum margin score")
+    parser.add_argument("--num-lists", type=int, help="Lists of each index (default: about 4 * sqrt(n))")
+    parser.add_argument("--nprobe", type=int, default=8, help="Lists searched per query")
+    return parser.parse_args()
+
+
+def main():
+    args = get_args()
+
+    indexes = {}
+    for side, path in (("src", args.src), ("tgt", args.tgt)):
+        offsets = get_line_offsets(path)
+        embeddings, index = build_corpus_index(
+            read_lines(path), len(offsets), os.path.join(args.work_dir, side),
+            model_name=args.model, batch_size=args.batch_size, num_lists=args.num_lists, source_path=path)
+        indexes[side] = (offsets, embeddings, index)
+
+    (src_offsets, src_embeddings, src_index), (tgt_offsets, tgt_embeddings, tgt_index) = indexes["src"], indexes["tgt"]
+
+    num_pairs = 0
+    with open(args.src, "rb") as src_file, open(args.tgt, "rb") as tgt_file, \
+            open(args.output, "w", encoding="utf-8") as output_file:
+        for score, i, j in mine_bitext(
+                src_embeddings, tgt_embeddings, src_index, tgt_index,
+                k=args.k, threshold=args.threshold, nprobe=args.nprobe):
+            output_file.write(
+                f"{score:.4f}\t{i}\t{j}\t{read_line(src_file, src_offsets[i])}\t{read_line(tgt_file, tgt_offsets[j])}\n")
+            num_pairs += 1
+
+    print(f"Mined {num_pairs} sentence pairs into {args.output}")
+
+
+if __name__ == "__main__":
+    main()
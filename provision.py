@@ -0,0 +1,40 @@
+"""
+Download the models and data used by the app into the local cache directory (RESOURCES_DIR),
+so that the app itself never downloads anything (unless RUNTIME_DOWNLOADS=1).
+The alignment checkpoints are kept in RESOURCES_DIR/huggingface, the flair PoS model in RESOURCES_DIR/flair.
+
+Example:
+    python provision.py --models "Google-mBERT (Base-Multilingual)" "SentenceTransformers-LaBSE (Multilingual)"
+"""
+
+import argparse
+
+from helper.alignment_mappers import select_model
+from helper.resources import provision_resources, get_startup_profile, is_offline, RESOURCES_DIR
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Download the models and data used by the app")
+    parser.add_argument("--models", nargs="*", default=[
+        "Google-mBERT (Base-Multilingual)", "SentenceTransformers-LaBSE (Multilingual)"],
+        help="Alignment models to download")
+    parser.add_argument("--no-pos-taggers", action="store_true",
+                        help="Skip the spaCy, NLTK and flair resources")
+    args = parser.parse_args()
+
+    offline = is_offline()
+    missing = provision_resources(
+        model_names=[select_model(model_name) for model_name in args.models],
+        pos_taggers=not args.no_pos_taggers, offline=offline)
+
+    if offline:
+        print(f"Offline: nothing downloaded, missing resources in {RESOURCES_DIR}: {missing or 'none'}")
+    else:
+        print(f"Resources provisioned in {RESOURCES_DIR}")
+
+    for module_name, seconds in get_startup_profile()["imports"].items():
+        print(f"import {module_name}: {seconds:.2f} s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,288 @@
+"""
+Headless HTTP/JSON alignment service backed by a pool of pre-warmed model worker processes.
+
+Endpoints:
+    POST /align            {"source", "target", "model", "extraction", "threshold", "layer"}
+    POST /translate-align  {"source", "language", "model"}
+    POST /pos-tag          {"source", "target", "model", "tagger"}
+    GET  /health           the server is up
+    GET  /ready            the workers have loaded their models (503 until then)
+    GET  /metrics          per-stage latency histograms and counters (Prometheus text format)
+    GET  /metrics.json     the same metrics as JSON (with estimated p50/p95/p99)
+
+Example:
+    python server.py --port 8000 --workers 4
+"""
+
+import json
+import argparse
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from helper.metrics import span, increment, profiled, get_metrics, merge_metrics, render_prometheus
+
+
+DEFAULT_MODEL = "Google-mBERT (Base-Multilingual)"
+
+
+_ready_barrier = None
+
+
+def _init_worker(model_names, threads_per_worker, ready_barrier):
+    global _ready_barrier
+    import torch
+    from helper.alignment_mappers import select_model, select_align_layer, select_encoder_backend
+    from helper.model_loaders import load_model_and_tokenizer
+
+    torch.set_num_threads(threads_per_worker)
+    for model_name in model_names:
+        load_model_and_tokenizer(
+            select_model(model_name), num_layers=select_align_layer(model_name),
+            backend=select_encoder_backend(model_name))
+    _ready_barrier = ready_barrier
+
+
+def _worker_status():
+    import os
+    from helper.model_loaders import get_model_cache_stats
+
+    # a worker runs one task at a time, so the status tasks only return once every worker
+    # has loaded its models and holds one of them
+    _ready_barrier.wait()
+    return {"pid": os.getpid(), "models": get_model_cache_stats()["cached_models"]}
+
+
+def _align(request):
+    from helper.alignment_mappers import get_alignment_mapping
+    from helper.alignment_results import AlignmentResult, render_dict
+
+    sent_src, sent_tgt, align_words = get_alignment_mapping(
+        source=request["source"], target=request["target"], model_name=request.get("model", DEFAULT_MODEL),
+        extraction=request.get("extraction", "intersection"), threshold=float(request.get("threshold", 1e-3)),
+        align_layer=request.get("layer"))
+
+    return render_dict(AlignmentResult.from_align_words(sent_src, sent_tgt, align_words))
+
+
+def _translate_align(request):
+    from helper.text_preprocess import space_punc
+    from helper.translators import select_target_lang_code, get_translations
+
+    src = space_punc(request["source"])
+    tgt_base, tgt = get_translations(src, select_target_lang_code(request.get("language", "English")))
+
+    result = _align({"source": src, "target": space_punc(tgt), "model": request.get("model", DEFAULT_MODEL)})
+    result["translation"] = tgt_base
+
+    return result
+
+
+def _pos_tag(request):
+    from helper.pos_taggers import get_postag_alignments
+    from helper.alignment_results import AlignmentResult, render_dict
+
+    sent_src, sent_tgt, tags = get_postag_alignments(
+        source=request["source"], target=request["target"],
+        model_name=request.get("model", DEFAULT_MODEL), tagger=request.get("tagger", "spaCy"))
+
+    # in the order of the pairs of the result
+    tags = sorted(tags, key=lambda tag: tag[:2])
+    result = AlignmentResult(sent_src, sent_tgt, [(i, j) for i, j, _ in tags])
+
+    return render_dict(result, tags=[tag for _, _, tag in tags])
+
+
+ROUTES = {
+    "/align": _align,
+    "/translate-align": _translate_align,
+    "/pos-tag": _pos_tag,
+}
+
+REQUIRED_FIELDS = {
+    "/align": ["source", "target"],
+    "/translate-align": ["source"],
+    "/pos-tag": ["source", "target"],
+}
+
+FIELD_TYPES = {
+    "source": str,
+    "target": str,
+    "model": str,
+    "extraction": str,
+    "language": str,
+    "tagger": str,
+    "threshold": (int, float),
+    "layer": int,
+}
+
+
+def get_request_error(path, request):
+    """
+    Get the reason a request body is invalid, or None
+    """
+    if not isinstance(request, dict):
+        return "the body must be a JSON object"
+    for field in REQUIRED_FIELDS[path]:
+        if field not in request:
+            return f"missing field: {field}"
+    for field, field_type in FIELD_TYPES.items():
+        value = request.get(field)
+        if value is not None and (isinstance(value, bool) or not isinstance(value, field_type)):
+            return f"invalid field: {field}"
+    return None
+
+
+def _run_request(path, request):
+    """
+    Run a request in a worker and return its result with the metrics recorded by the worker since its
+    previous request, which the server merges into its own
+    """
+    with profiled(path.strip("/")), span(f"request{path}"):
+        result = ROUTES[path](request)
+    return result, get_metrics(reset=True)
+
+
+class AlignmentService:
+    """
+    Run the requests on a process pool, rejecting them when `max_pending` requests are already queued
+    """
+
+    def __init__(self, workers, threads_per_worker, model_names, max_pending, timeout):
+        from helper.alignment_mappers import select_model
+
+        self.workers = workers
+        # only the models loaded by the workers are served
+        self.models = set(select_model(model_name) for model_name in model_names)
+        self.timeout = timeout
+        context = multiprocessing.get_context()
+        self.pool = ProcessPoolExecutor(
+            max_workers=workers, mp_context=context, initializer=_init_worker,
+            initargs=(model_names, threads_per_worker, context.Barrier(workers)))
+        self.pending = threading.BoundedSemaphore(max_pending)
+        self.warm_up = [self.pool.submit(_worker_status) for _ in range(workers)]
+
+    def is_ready(self):
+        return all(future.done() and future.exception() is None for future in self.warm_up)
+
+    def get_status(self):
+        workers = dict(
+            (status["pid"], status["models"])
+            for status in (future.result() for future in self.warm_up if future.done() and future.exception() is None))
+        return {"ready": self.is_ready(), "workers": workers}
+
+    def run(self, path, request):
+        """
+        Returns the (HTTP status, JSON body) of a request
+        """
+        from helper.alignment_mappers import select_model
+
+        error = get_request_error(path, request)
+        if error is None and select_model(request.get("model", DEFAULT_MODEL)) not in self.models:
+            error = f"model not served: {request.get('model', DEFAULT_MODEL)}"
+        if error is not None:
+            increment("server.bad_requests")
+            return 400, {"error": error}
+
+        if not self.pending.acquire(blocking=False):
+            increment("server.rejected")
+            return 429, {"error": "too many pending requests"}
+
+        future = None
+        try:
+            with span(f"server{path}"):
+                future = self.pool.submit(_run_request, path, request)
+                try:
+                    result, metrics = future.result(timeout=self.timeout)
+                except TimeoutError:
+                    future.cancel()
+                    increment("server.timeouts")
+                    return 504, {"error": f"request timed out after {self.timeout} s"}
+                except (KeyError, ValueError) as e:
+                    increment("server.bad_requests")
+                    return 400, {"error": f"{type(e).__name__}: {e}"}
+            merge_metrics(metrics)
+            return 200, result
+        except Exception as e:
+            increment("server.errors")
+            return 500, {"error": f"{type(e).__name__}: {e}"}
+        finally:
+            if future is None:
+                self.pending.release()
+            else:
+                # a running task cannot be cancelled, it keeps its pending slot until its worker is done
+                future.add_done_callback(lambda _: self.pending.release())
+
+
+def get_handler(service):
+
+    class Handler(BaseHTTPRequestHandler):
+
+        def _send(self, status, body, content_type="application/json"):
+            if content_type == "application/json":
+                data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+            else:
+                data = body.encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", f"{content_type}; charset=utf-8")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if self.path == "/health":
+                self._send(200, {"status": "ok"})
+            elif self.path == "/ready":
+                status = service.get_status()
+                self._send(200 if status["ready"] else 503, status)
+            elif self.path == "/metrics":
+                self._send(200, render_prometheus(), content_type="text/plain; version=0.0.4")
+            elif self.path == "/metrics.json":
+                self._send(200, get_metrics())
+            else:
+                self._send(404, {"error": "not found"})
+
+        def do_POST(self):
+            if self.path not in ROUTES:
+                self._send(404, {"error": "not found"})
+                return
+
+            try:
+                request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            except ValueError:
+                self._send(400, {"error": "invalid JSON body"})
+                return
+
+            self._send(*service.run(self.path, request))
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="HTTP/JSON alignment service")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--threads-per-worker", type=int, default=1)
+    parser.add_argument("--models", nargs="*", default=[DEFAULT_MODEL],
+                        help="Models loaded by every worker at startup, the only ones served")
+    parser.add_argument("--max-pending", type=int, default=64,
+                        help="Requests queued before answering 429")
+    parser.add_argument("--timeout", type=float, default=30.0,
+                        help="Request timeout in seconds")
+    args = parser.parse_args()
+
+    service = AlignmentService(
+        args.workers, args.threads_per_worker, args.models, args.max_pending, args.timeout)
+
+    server = ThreadingHTTPServer((args.host, args.port), get_handler(service))
+    print(f"Serving on http://{args.host}:{args.port}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()